@@ -1,134 +1,535 @@
 #!/usr/bin/env python
 
+import os.path
 import sys
 import time
 import logging
 import argparse
 from collections import defaultdict
-from multiprocessing import Pool
 
-from ovirtsdk.xml import params
-from ovirtsdk.api import API
+# modules shared by all the tools, see common/
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                os.pardir, 'common'))
+from clock import monotonic
+from histogram import Histogram
+from journal import Journal
+from runner import Runner
+from session import Session
+import workload
 
 
 class VMHandle(object):
-    def __init__(self, api, a, name='Tiny'):
-        self._api = api
+    _PHASES = ('created', 'arrived', 'dispatched',
+               'started', 'powered', 'up', 'stopped', 'down')
+
+    def __init__(self, session, a, name='Tiny', timeout=None,
+                 open_loop=False):
+        self._session = session
+        self._basename = name
         self._name = '%s%i' % (name, a)
         logging.info(self._name)
-        self._marks = {'created': time.time()}
+        now = monotonic()
+        # wall clock anchor, to line the marks up with samples taken
+        # elsewhere, e.g. by capture.py; see correlate.py
+        self._epoch = time.time()
+        self._marks = {'created': now}
+        self._errors = {'created': 0.0}
+        # any state change we observe happened after this instant
+        self._seen = now
+        self._state = None
+        self._timeout = timeout
+        # in open-loop workloads, the deadline is set on arrival
+        self._open_loop = open_loop
+        self._deadline = None
+        if timeout is not None and not open_loop:
+            self._deadline = now + timeout
 
-    def _mark(self, state):
+    def _mark(self, state, begin, end):
+        """
+        The transition to `state' happened somewhere in [begin, end]:
+        record the midpoint and keep the half-width as uncertainty.
+        """
         if state not in self._marks:
-            self._marks[state] = time.time()
+            self._marks[state] = (begin + end) / 2.
+            self._errors[state] = (end - begin) / 2.
+
+    def mark(self, state):
+        now = monotonic()
+        self._mark(state, now, now)
+
+    def arrive(self, when):
+        """
+        The VM is due to start at `when', in an open-loop workload;
+        its deadline is counted from there.
+        """
+        self._mark('arrived', when, when)
+        if self._timeout is not None:
+            self._deadline = when + self._timeout
+
+    def when(self, state):
+        return self._marks[state]
+
+    def interval(self, begin, end):
+        return self._marks[end] - self._marks[begin]
+
+    @property
+    def marks(self):
+        """
+        All the marks, in seconds since the VM handle was created,
+        plus 'epoch': the wall clock time of the creation.
+        """
+        created = self._marks['created']
+        marks = dict((state, when - created)
+                     for state, when in self._marks.items())
+        marks['epoch'] = self._epoch
+        return marks
 
     @property
     def startup_time(self):
-        return self._marks['up'] - self._marks['created']
+        return startup_time(self._marks)
+
+    @property
+    def arrived(self):
+        """False for open-loop VMs not yet due to start."""
+        return not self._open_loop or 'arrived' in self._marks
+
+    @property
+    def age(self):
+        """Seconds since the VM arrived, or was created if not open-loop."""
+        return monotonic() - self._marks.get('arrived',
+                                             self._marks['created'])
+
+    @property
+    def expired(self):
+        return self._deadline is not None and monotonic() > self._deadline
+
+    @property
+    def last_state(self):
+        return self._state
+
+    def reached(self, state):
+        return state in self._marks
+
+    def phases(self):
+        """
+        Yields (begin, end, duration, uncertainty) for every lifecycle
+        phase this VM went through.
+        """
+        marks = [m for m in self._PHASES if m in self._marks]
+        for begin, end in zip(marks, marks[1:]):
+            yield (begin, end,
+                   self._marks[end] - self._marks[begin],
+                   self._errors[end] + self._errors[begin])
 
     @property
-    def _handle(self):
-        return self._api.vms.get(self._name)
+    def _api(self):
+        return self._session.api
+
+    def remember(self, item):
+        """
+        Keeps the id of `item', this VM as found by a search, so it is
+        fetched by id from then on. Only the id is kept: VMs are
+        fetched again on the API of the thread acting on them.
+        """
+        self._session.remember_vm(self._name, item.id)
+
+    def _fetch(self):
+        """
+        Returns (VM, begin, end): the VM fetched on the API of the
+        calling thread by a query issued at `begin' and completed at
+        `end'. A VM no longer found by its id, e.g. recreated, is
+        looked up again by name; raises RuntimeError if not found.
+        """
+        begin = monotonic()
+        item = None
+        vm_id = self._session.vm_id(self._name)
+        if vm_id is not None:
+            item = self._api.vms.get(id=vm_id)
+            if item is None:
+                logging.warning('%s: no VM with id %s, looking it up again',
+                                self._name, vm_id)
+                self._session.forget_vm(self._name, vm_id)
+        if item is None:
+            item = self._api.vms.get(self._name)
+            if item is None:
+                raise RuntimeError('%s: no such VM' % self._name)
+            self.remember(item)
+        return item, begin, monotonic()
 
     @property
     def name(self):
         return self._name
 
     @property
-    def state(self):
-        st = self._handle.status.state
+    def basename(self):
+        return self._basename
+
+    def update(self, st, begin, end):
+        """
+        Feeds the state `st' observed by a query issued at `begin'
+        and completed at `end' (both monotonic).
+        """
         if st == 'powering_up':
-            self._mark('powered')
+            self._mark('powered', self._seen, end)
         elif st == 'up':
-            self._mark('up')
+            self._mark('up', self._seen, end)
+        elif st == 'down' and 'stopped' in self._marks:
+            self._mark('down', self._seen, end)
+        self._seen = max(self._seen, begin)
+        self._state = st
         return st
 
+    @property
+    def state(self):
+        item, begin, end = self._fetch()
+        return self.update(item.status.state, begin, end)
+
     @property
     def running(self):
         return self.state == 'up'
 
     def start(self):
-        if not self.running:
+        item, begin, end = self._fetch()
+        if self.update(item.status.state, begin, end) != 'up':
             logging.info('Starting VM: %s', self._name)
-            self._mark('started')
-            self._handle.start()
+            begin = monotonic()
+            item.start()
+            end = monotonic()
+            self._mark('started', begin, end)
+            self._seen = max(self._seen, begin)
 
     def stop(self):
-        if self.running:
+        item, begin, end = self._fetch()
+        if self.update(item.status.state, begin, end) not in (
+                'down', 'powering_down'):
             logging.info('Stopping VM: %s', self._name)
-            self._handle.stop()
-            self._mark('stopped')
+            begin = monotonic()
+            item.stop()
+            self._mark('stopped', begin, monotonic())
+            self._seen = max(self._seen, begin)
+            if self._timeout is not None:
+                self._deadline = begin + self._timeout
+
+
+def startup_time(marks):
+    origin = 'arrived' if 'arrived' in marks else 'created'
+    return marks['up'] - marks[origin]
+
+
+# marks set by the workload, not the engine: the phases ending at them,
+# waiting for an open-loop arrival or the stop, are not latencies
+_WAITS = ('arrived', 'stopped')
+
+
+def is_latency(begin, end):
+    return end not in _WAITS
+
+
+class Poller(object):
+    """
+    Fetches the state of all the tracked VMs using one search query
+    per VM basename, instead of one GET per VM.
+    """
+    def __init__(self, session, vms):
+        self._session = session
+        self._vms = dict((vm.name, vm) for vm in vms)
+        self._queries = sorted(set('name=%s*' % vm.basename for vm in vms))
+
+    def poll(self):
+        states = {}
+        for query in self._queries:
+            begin = monotonic()
+            items = self._session.api.vms.list(query=query)
+            end = monotonic()
+            for item in items:
+                vm = self._vms.get(item.name)
+                if vm is not None:
+                    vm.remember(item)
+                    states[vm.name] = vm.update(item.status.state,
+                                                begin, end)
+        return states
+
+
+class Backoff(object):
+    """
+    Polling interval which stays tight while something is about to
+    happen, and grows exponentially while nothing does.
+    """
+    def __init__(self, low=0.1, high=2.0, factor=2.0):
+        self._low = low
+        self._high = high
+        self._factor = factor
+        self._cur = low
+
+    @property
+    def high(self):
+        return self._high
+
+    def next(self, busy):
+        if busy:
+            self._cur = self._low
+        else:
+            self._cur = min(self._cur * self._factor, self._high)
+        return self._cur
+
 
+def _start(vm):
+    vm.start()
+
+
+def _stop(vm):
+    vm.stop()
 
-def _run(vm):
+
+def _dispatch(vm):
+    vm.mark('dispatched')
     vm.start()
 
 
-def start(vms, pool=None):
-    if pool is None:
+def start(vms, runner=None):
+    if runner is None:
         logging.info('start: serial execution')
         for vm in vms:
             vm.start()
     else:
         logging.info('start: parallel execution')
-        pool.map(_run, vms)
+        runner.map(_start, vms)
 
 
-def stop(vms):
-    for vm in vms:
-        vm.stop()
+def stop(vms, runner=None):
+    if runner is None:
+        for vm in vms:
+            vm.stop()
+    else:
+        runner.map(_stop, vms)
+
+
+_TRANSIENT_STATES = frozenset(('wait_for_launch', 'powering_up',
+                               'powering_down', 'reboot_in_progress'))
+
 
+def _median(values):
+    values = sorted(values)
+    return values[len(values) // 2] if values else None
 
-def wait(vms, state='up'):
+
+def _busy(pending, changed, expected, slack):
+    """
+    Tells if a VM state transition is likely to happen soon: either
+    something changed in the last poll, a VM is in a transient state,
+    or a VM is as old as the VMs which already reached the target.
+    """
+    if changed:
+        return True
+    if any(vm.last_state in _TRANSIENT_STATES for vm in pending):
+        return True
+    if expected is not None:
+        return any(abs(vm.age - expected) <= slack
+                   for vm in pending if vm.arrived)
+    return False
+
+
+def wait(session, vms, state='up', interval=(0.1, 2.0)):
+    poller = Poller(session, vms)
+    backoff = Backoff(*interval)
     step = 1
     pending = set(vm for vm in vms)
+    done = []
     while pending:
         logging.info('* step #%02i: still pending: %i VMs (%s)',
                      step, len(pending), ','.join(vm.name for vm in pending))
+        begin = monotonic()
+        before = dict((vm.name, vm.last_state) for vm in pending)
+        states = poller.poll()
         npending = set()
         for vm in pending:
-            if vm.state == state:
+            st = states.get(vm.name)
+            if not vm.arrived:
+                # not dispatched yet, whatever the schedule length
+                npending.add(vm)
+            elif st == state:
                 logging.info('* step #%02i: VM %s ready! (%s)',
-                             step, vm.name, vm.state)
+                             step, vm.name, st)
+                done.append(vm.age)
+            elif vm.expired:
+                logging.warning('* step #%02i: VM %s missed its deadline (%s)',
+                                step, vm.name, st)
             else:
                 npending.add(vm)
+        changed = any(before[vm.name] != vm.last_state for vm in pending)
         pending = npending
         step += 1
-        time.sleep(1)
+        if pending:
+            delay = backoff.next(_busy(pending, changed,
+                                       _median(done), backoff.high))
+            # sleep up to the next deadline, absorbing the poll latency
+            time.sleep(max(0., begin + delay - monotonic()))
+
+
+def report(vms):
+    phases = defaultdict(list)
+    for vm in vms:
+        for begin, end, duration, error in vm.phases():
+            logging.debug('VM %s: %s->%s: %.3fs +/- %.3fs',
+                          vm.name, begin, end, duration, error)
+            if is_latency(begin, end):
+                phases[(begin, end)].append((duration, error))
+    order = VMHandle._PHASES
+    for begin, end in sorted(phases, key=lambda p: order.index(p[0])):
+        values = phases[(begin, end)]
+        logging.info('phase %s->%s: mean %.3fs, worst uncertainty +/- %.3fs',
+                     begin, end,
+                     sum(v[0] for v in values) / len(values),
+                     max(v[1] for v in values))
+
+
+class QuiesceError(Exception):
+    """Some VMs are still not down before a run"""
+
 
+def quiesce(session, name, n, runner=None, timeout=120.,
+            interval=(0.1, 2.0), settle=0.):
+    """
+    Stops the VMs left over by the previous run, so they don't disturb
+    the next one, and waits up to `timeout' seconds for all of them to
+    be down. Raises QuiesceError if some are not, rather than
+    benchmarking on a dirty cluster.
+    """
+    logging.info('quiesce: stopping the VMs not down out of %i', n)
+    probes = [ VMHandle(session, a, name, timeout) for a in range(n) ]
+    stop(probes, runner)
+    wait(session, probes, state='down', interval=interval)
+    left = sorted(vm.name for vm in probes if vm.last_state != 'down')
+    if left:
+        raise QuiesceError('%i VMs still not down after %.0fs: %s' % (
+            len(left), timeout, ','.join(left)))
+    if settle > 0:
+        logging.info('quiesce: settling for %.1fs', settle)
+        time.sleep(settle)
 
-def mass_start(name, n, pool, api):
-    vms = [ VMHandle(api, a, name) for a in range(n) ]
-    start(vms, pool)
-    wait(vms)
-    stop(vms)
-    return dict((vm.name, vm.startup_time) for vm in vms)
 
+def shutdown(session, vms, runner, interval=(0.1, 2.0)):
+    stop(vms, runner)
+    wait(session, vms, state='down', interval=interval)
 
-def bench(n, func, *args):
+
+def mass_start(name, n, runner, session, timeout=None, interval=(0.1, 2.0),
+               settle=0., quiesce_timeout=120.):
+    quiesce(session, name, n, runner, quiesce_timeout, interval, settle)
+    vms = [ VMHandle(session, a, name, timeout) for a in range(n) ]
+    start(vms, runner)
+    wait(session, vms, interval=interval)
+    shutdown(session, vms, runner, interval)
+    report(vms)
+    return dict((vm.name, vm.marks) for vm in vms)
+
+
+def load_start(name, n, runner, session, schedule, timeout=None,
+               interval=(0.1, 2.0), settle=0., quiesce_timeout=120.):
+    expected = sum(1 for _ in workload.arrivals(schedule))
+    if expected > n:
+        logging.warning('workload: schedule wants %i arrivals, '
+                        'only %i VMs available', expected, n)
+    quiesce(session, name, n, runner, quiesce_timeout, interval, settle)
+    vms = [ VMHandle(session, a, name, timeout, open_loop=True)
+            for a in range(min(n, expected)) ]
+    dispatcher = workload.Dispatcher(vms, runner, schedule, _dispatch)
+    dispatcher.start()
+    wait(session, vms, interval=interval)
+    dispatcher.join()
+    workload.report(vms, schedule, dispatcher.begin)
+    shutdown(session, vms, runner, interval)
+    report(vms)
+    return dict((vm.name, vm.marks) for vm in vms)
+
+
+def bench(n, func, *args, **kwargs):
+    journal = kwargs.pop('journal', None)
+    resume = kwargs.pop('resume', False)
+    done = journal.open(resume) if journal is not None else {}
     aggr = defaultdict(list)
-    for i in range(n):
-        res = func(*args)
-        for k, v in res.items():
-            aggr[k].append(v)
+    try:
+        for i in range(n):
+            if i in done:
+                logging.info('bench: run #%i already in the journal, '
+                             'skipped', i)
+                res = done[i]
+            else:
+                res = func(*args, **kwargs)
+                if journal is not None:
+                    journal.append(i, res)
+            for k, v in res.items():
+                aggr[k].append(v)
+    finally:
+        if journal is not None:
+            journal.close()
     return aggr
 
 
+def summarize(res):
+    """
+    Builds one histogram per lifecycle phase, plus one for the whole
+    startup, out of the marks of all the VMs in all the runs. The
+    waits set by the workload are left out, see is_latency().
+    """
+    hists = defaultdict(Histogram)
+    for runs in res.values():
+        for marks in runs:
+            names = [m for m in VMHandle._PHASES if m in marks]
+            for begin, end in zip(names, names[1:]):
+                if is_latency(begin, end):
+                    hists[(begin, end)].record(marks[end] - marks[begin])
+            if 'up' in marks:
+                hists[('startup', 'up')].record(startup_time(marks))
+    order = VMHandle._PHASES + ('startup',)
+    return [('%s->%s' % key if key[0] != 'startup' else 'startup',
+             hists[key])
+            for key in sorted(hists, key=lambda k: order.index(k[0]))]
+
+
+_PERCENTILES = (50, 90, 99)
+
+
 def dump(res, store_file):
     def _write(res, dst):
+        # one column per run: a VM which did not come up gets 'nan',
+        # so the columns stay aligned across the VMs
         for k in sorted(res.keys()):
-            dst.write('%s\t%s\n' % (k, '\t'.join('%f' % v for v in res[k])))
+            dst.write('%s\t%s\n' % (k, '\t'.join(
+                '%f' % startup_time(marks) if 'up' in marks else 'nan'
+                for marks in res[k])))
+
+    def _write_summary(res, dst):
+        dst.write('phase\tcount\tmean\t%s\tmax\n' % '\t'.join(
+            'p%i' % pct for pct in _PERCENTILES))
+        for phase, hist in summarize(res):
+            dst.write('%s\t%i\t%f\t%s\t%f\n' % (
+                phase, hist.count, hist.mean,
+                '\t'.join('%f' % hist.percentile(pct)
+                          for pct in _PERCENTILES),
+                hist.max))
+
     if store_file:
         tag = time.strftime('%Y%m%d_%H%M%S')
         with open('bench_%s.csv' % tag, 'wt') as dst:
             _write(res, dst)
+        with open('bench_%s_summary.csv' % tag, 'wt') as dst:
+            _write_summary(res, dst)
     else:
         _write(res, sys.stdout)
+        _write_summary(res, sys.stdout)
 
 
 if __name__ == '__main__':
     logging.basicConfig(level=logging.DEBUG)
     parser = argparse.ArgumentParser()
+    parser.add_argument('-U', '--url', help='engine API URL '
+                        '[http://engine:8080/api]',
+                        type=str, default='http://engine:8080/api')
+    parser.add_argument('--username', help='engine user [user@internal]',
+                        type=str, default='user@internal')
+    parser.add_argument('--password', help='engine password [pass]',
+                        type=str, default='pass')
     parser.add_argument('-r', '--runs', help='amount of runs to do [3]',
                         type=int, default=3)
     parser.add_argument('-n', '--num-vms', help='number of VMs [32]',
@@ -139,15 +540,87 @@ if __name__ == '__main__':
                         action='store_false', dest='parallel')
     parser.add_argument('-S', '--store-result', help='store result to file',
                         action='store_true')
+    parser.add_argument('-J', '--journal',
+                        help='append the results of each run to this file',
+                        type=str, default=None)
+    parser.add_argument('--resume',
+                        help='skip the runs already in the journal',
+                        action='store_true')
+    parser.add_argument('-c', '--concurrency',
+                        help='max VM operations in flight [32]',
+                        type=int, default=32)
+    parser.add_argument('-R', '--rate',
+                        help='max VM operations per second [unlimited]',
+                        type=float, default=None)
+    parser.add_argument('-A', '--arrival',
+                        help='start VMs at an arrival rate instead of '
+                        'all at once, e.g. 5x60,20x30 or 1-20x120 '
+                        '(VMs/s x seconds)',
+                        type=workload.parse_schedule, default=None)
+    parser.add_argument('-T', '--timeout',
+                        help='seconds a VM may take to come up [600]',
+                        type=float, default=600.)
+    parser.add_argument('--settle',
+                        help='seconds to wait once all VMs are down, '
+                        'before each run [0]',
+                        type=float, default=0.)
+    parser.add_argument('--quiesce-timeout',
+                        help='seconds the VMs left over by a run may take '
+                        'to go down, before the run is aborted [120]',
+                        type=float, default=120.)
+    parser.add_argument('--min-interval',
+                        help='polling interval near transitions [0.1]',
+                        type=float, default=0.1)
+    parser.add_argument('--max-interval',
+                        help='polling interval while idle [2.0]',
+                        type=float, default=2.0)
     args = parser.parse_args()
 
-    api = API(url='http://engine:8080/api', username='user@internal', password='pass')
+    if args.resume and args.journal is None:
+        parser.error('--resume needs a --journal')
+
+    session = Session(url=args.url,
+                      username=args.username, password=args.password)
+    session.api
+
+    if args.arrival is not None and not args.parallel:
+        parser.error('arrival rate workloads need parallel execution')
 
     if args.parallel:
-        logging.info('pool size is %i', args.num_vms)
-        pool = Pool(args.num_vms)
+        # workers log in once, before any VM is started
+        runner = Runner(min(args.concurrency, args.num_vms), args.rate,
+                        initializer=lambda: session.api)
+    else:
+        runner = None
+
+    if args.arrival is None:
+        func, extra = mass_start, ()
     else:
-        pool = None
+        func, extra = load_start, (args.arrival,)
+
+    journal = None
+    if args.journal is not None:
+        journal = Journal(args.journal, {'vm_name': args.vm_name,
+                                         'num_vms': args.num_vms,
+                                         'arrival': args.arrival})
 
-    res = bench(args.runs, mass_start, args.vm_name, args.num_vms, pool, api)
+    try:
+        res = bench(args.runs, func, args.vm_name, args.num_vms,
+                    runner, session, *extra,
+                    timeout=args.timeout,
+                    interval=(args.min_interval, args.max_interval),
+                    settle=args.settle,
+                    quiesce_timeout=args.quiesce_timeout,
+                    journal=journal,
+                    resume=args.resume)
+    except QuiesceError as exc:
+        logging.error('bench: aborted: %s', exc)
+        res = None
+    finally:
+        if runner is not None:
+            runner.close()
+        session.report()
+        session.close()
+    if res is None:
+        sys.exit(1)
     dump(res, args.store_result)
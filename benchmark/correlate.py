@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+"""
+Correlates the VM lifecycle marks of bench.py with the resource samples
+taken on the host meanwhile by capture.py or vdsmmon.py, to tell the
+CPU cost of starting VMs: VDSM CPU-seconds per VM start.
+
+The marks come from the bench journal (bench.py -J). They are monotonic
+times relative to each VM handle, plus the wall clock time the handle
+was created. The samples carry the wall clock time of the host. With
+--offset, the host clock being that much ahead of the bench one, the
+two line up. The merged output of observe.py is already on the harness
+clock.
+
+The CPU usage of a sample is averaged since the previous one, so it
+covers the time slice in between. The CPU-seconds of every slice are
+split evenly among the VMs starting up in it, from 'started' to 'up'.
+The baseline is the usage before the first start. It is subtracted to
+tell the excess, the cost of the starts alone.
+"""
+
+import argparse
+import json
+import logging
+import os.path
+import sys
+
+# modules shared by all the tools, see common/
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                os.pardir, 'common'))
+import collect
+
+
+# names of the processes in capture.py and vdsmmon.py samples
+_PROCESSES = (('vdsm', ('vdsm_main', 'vdsm')),
+              ('libvirtd', ('libvirtd',)))
+
+
+def load_runs(path):
+    """Returns [(run, {VM name: marks})] from a bench.py journal."""
+    runs = []
+    with open(path, 'rt') as src:
+        for line in src:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                break  # torn last line
+            if 'run' in entry:
+                runs.append((entry['run'], entry['results']))
+    return sorted(runs)
+
+
+def _cpu(record, names):
+    for name in names:
+        sample = record.get(name)
+        if isinstance(sample, dict) and sample.get('cpu') is not None:
+            return sample['cpu']
+    return None
+
+
+def load_samples(path, source=None):
+    """
+    Returns [(timestamp, cpu of every process in _PROCESSES)], in time
+    order, from capture.py JSON or vdsmmon.py CSV files. A merged
+    multi-host file is narrowed to the samples of `source'; raises
+    ValueError without it, rather than mixing up the hosts.
+    """
+    series = []
+    hosts = set()
+    for record in collect.samples(path):
+        host = record.get('source')
+        if host is not None:
+            hosts.add(host)
+        if host != source or 'timestamp' not in record:
+            continue
+        series.append((record['timestamp'],) + tuple(
+            _cpu(record, names) for _, names in _PROCESSES))
+    if source is None and hosts:
+        raise ValueError('%s: samples of %s, pick one host with --source' %
+                         (path, ', '.join(sorted(hosts))))
+    series.sort()
+    return series
+
+
+def slices(series):
+    """Yields (begin, end, cpu usages) of the time slices sampled."""
+    for prev, cur in zip(series, series[1:]):
+        yield prev[0], cur[0], [None if cpu is None or cpu != cpu else cpu
+                                for cpu in cur[1:]]
+
+
+def windows(results, offset=0.):
+    """
+    Returns {VM name: (started, up)} on the host clock, for the VMs
+    which came up.
+    """
+    found = {}
+    for name, marks in results.items():
+        if 'epoch' not in marks:
+            raise ValueError('%s: marks without epoch, from a bench.py '
+                             'too old to correlate' % name)
+        if 'up' not in marks:
+            continue
+        begin = marks.get('started', marks['created'])
+        found[name] = (marks['epoch'] + begin + offset,
+                       marks['epoch'] + marks['up'] + offset)
+    return found
+
+
+def _overlap(begin, end, low, high):
+    return max(0., min(end, high) - max(begin, low))
+
+
+def attribute(sliced, vms):
+    """
+    Returns {VM name: [CPU-seconds of every process]} splitting the
+    usage of every slice evenly among the VMs starting up in it.
+    """
+    shares = dict((name, [0.] * len(_PROCESSES)) for name in vms)
+    for begin, end, usage in sliced:
+        active = [(name, _overlap(begin, end, low, high))
+                  for name, (low, high) in vms.items()]
+        active = [(name, secs) for name, secs in active if secs > 0]
+        for name, secs in active:
+            for idx, cpu in enumerate(usage):
+                if cpu is not None:
+                    shares[name][idx] += cpu / 100. * secs / len(active)
+    return shares
+
+
+def usage(sliced, low, high):
+    """Returns [CPU-seconds of every process] within [low, high]."""
+    total = [0.] * len(_PROCESSES)
+    for begin, end, cpus in sliced:
+        secs = _overlap(begin, end, low, high)
+        for idx, cpu in enumerate(cpus):
+            if cpu is not None:
+                total[idx] += cpu / 100. * secs
+    return total
+
+
+def correlate(run, results, series, offset=0., baseline=30.):
+    """
+    Returns the report of one run as a dict, None if no VM of the run
+    came up.
+    """
+    vms = windows(results, offset)
+    if not vms or not series:
+        return None
+    first = min(low for low, _ in vms.values())
+    last = max(high for _, high in vms.values())
+    if first < series[0][0] or last > series[-1][0]:
+        logging.warning('run %s: the samples cover %.1f-%.1f, '
+                        'the starts %.1f-%.1f: wrong clock offset?',
+                        run, series[0][0], series[-1][0], first, last)
+    sliced = list(slices(series))
+    span = last - first
+    busy = usage(sliced, first, last)
+    idle = usage(sliced, first - baseline, first)
+    covered = sum(_overlap(begin, end, first - baseline, first)
+                  for begin, end, _ in sliced)
+    report = {
+        'run': run,
+        'vms': len(vms),
+        'failed': len(results) - len(vms),
+        'span': span,
+        'begin': first,
+        'windows': vms,
+        'shares': attribute(sliced, vms),
+    }
+    for idx, (proc, _) in enumerate(_PROCESSES):
+        rate = idle[idx] / covered if covered > 0 else 0.
+        report[proc] = {
+            'cpu_s': busy[idx],
+            'per_vm': busy[idx] / len(vms),
+            'baseline': rate * 100.,
+            'excess_per_vm': max(0., busy[idx] - rate * span) / len(vms),
+        }
+    return report
+
+
+def show(reports, out=sys.stdout):
+    for rep in reports:
+        out.write('run %s: %i VMs up, %i failed, startup span %.1fs\n' % (
+            rep['run'], rep['vms'], rep['failed'], rep['span']))
+        for proc, _ in _PROCESSES:
+            stats = rep[proc]
+            out.write('  %-8s %8.2f cpu-s, %6.3f cpu-s/VM start; '
+                      'baseline %5.1f%%, %6.3f cpu-s/VM over it\n' % (
+                          proc, stats['cpu_s'], stats['per_vm'],
+                          stats['baseline'], stats['excess_per_vm']))
+    if len(reports) > 1:
+        for proc, _ in _PROCESSES:
+            values = [rep[proc]['per_vm'] for rep in reports]
+            excess = [rep[proc]['excess_per_vm'] for rep in reports]
+            out.write('all runs: %s %.3f cpu-s/VM start, %.3f over the '
+                      'baseline (mean of %i runs)\n' % (
+                          proc, sum(values) / len(values),
+                          sum(excess) / len(excess), len(reports)))
+
+
+def dump(reports, path):
+    """Writes the CPU-seconds attributed to every VM start, as CSV."""
+    with open(path, 'wt') as out:
+        out.write('run,vm,started,up,%s\n' % ','.join(
+            '%s_cpu_s' % proc for proc, _ in _PROCESSES))
+        for rep in reports:
+            for name in sorted(rep['windows']):
+                low, high = rep['windows'][name]
+                out.write('%s,%s,%f,%f,%s\n' % (
+                    rep['run'], name, low - rep['begin'],
+                    high - rep['begin'],
+                    ','.join('%f' % cpu for cpu in rep['shares'][name])))
+
+
+def plot(runs, series, offset, path=None):
+    """
+    Overlays the VMs started, powering up and up over the CPU usage
+    of vdsm and libvirtd.
+    """
+    import matplotlib.pyplot as plt
+
+    origin = series[0][0]
+    times = [s[0] - origin for s in series]
+    fig, ax = plt.subplots()
+    for idx, ((proc, _), color) in enumerate(zip(_PROCESSES, ('r', 'g'))):
+        ax.plot(times, [s[idx + 1] for s in series], color, label=proc)
+    ax.set_xlabel('time in secs')
+    ax.set_ylabel('cpu % - 100% is one core')
+    ax.grid(True)
+    counts = ax.twinx()
+    for state, color in (('started', 'c'), ('powered', 'b'), ('up', 'k')):
+        stamps = sorted(marks['epoch'] + marks[state] + offset - origin
+                        for _, results in runs
+                        for marks in results.values() if state in marks)
+        counts.step(stamps, range(1, len(stamps) + 1), color,
+                    where='post', label='VMs %s' % state)
+    counts.set_ylabel('VMs')
+    ax.legend(loc='upper left')
+    counts.legend(loc='upper right')
+    if path:
+        fig.set_size_inches(18.5, 10.5)
+        fig.savefig(path)
+    else:
+        plt.show()
+
+
+def _main():
+    parser = argparse.ArgumentParser(
+        description='VDSM CPU-seconds per VM start, out of a bench.py '
+                    'journal and the samples of the host')
+    parser.add_argument('journal', help='bench.py journal (-J)')
+    parser.add_argument('samples',
+                        help='capture.py JSON or vdsmmon.py CSV samples')
+    parser.add_argument('-o', '--offset',
+                        help='seconds the host clock is ahead of the bench '
+                        'one [0]', type=float, default=0.)
+    parser.add_argument('-s', '--source',
+                        help='host to pick from a merged observe.py file',
+                        type=str, default=None)
+    parser.add_argument('-b', '--baseline',
+                        help='seconds before the first start giving the '
+                        'baseline usage [30]', type=float, default=30.)
+    parser.add_argument('-c', '--csv',
+                        help='save the CPU-seconds of every VM start here',
+                        type=str, default=None)
+    parser.add_argument('-p', '--plot', action='store_true',
+                        help='plot the VM states over the CPU usage')
+    parser.add_argument('--plot-file', help='save the plot here',
+                        type=str, default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    runs = load_runs(args.journal)
+    try:
+        series = load_samples(args.samples, args.source)
+    except ValueError as exc:
+        logging.error('%s', exc)
+        sys.exit(1)
+    if not runs or not series:
+        logging.error('nothing to correlate: %i runs, %i samples',
+                      len(runs), len(series))
+        sys.exit(1)
+    try:
+        reports = [correlate(run, results, series, args.offset,
+                             args.baseline)
+                   for run, results in runs]
+    except ValueError as exc:
+        logging.error('%s', exc)
+        sys.exit(1)
+    reports = [rep for rep in reports if rep is not None]
+    show(reports)
+    if args.csv:
+        dump(reports, args.csv)
+    if args.plot or args.plot_file:
+        plot(runs, series, args.offset, args.plot_file)
+
+
+if __name__ == '__main__':
+    _main()
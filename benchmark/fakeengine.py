@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+"""
+Local stand-in for the engine REST API, good enough for the ovirtsdk
+calls the harness does: login, VM search/lookup, start and stop.
+
+VMs follow a simulated lifecycle:
+  down -> wait_for_launch -> powering_up -> up -> powering_down -> down
+The states are computed lazily from the time of the last action, so
+thousands of VMs cost nothing while idle. Every request can be
+delayed by a configurable latency, and every delay can be jittered.
+"""
+
+import argparse
+import fnmatch
+import logging
+import random
+import re
+import threading
+import time
+import urllib
+import urlparse
+import uuid
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from xml.sax.saxutils import escape
+
+
+class Timings(object):
+    def __init__(self, launch=0.5, boot=5.0, shutdown=2.0,
+                 latency=0.01, jitter=0.1):
+        self.launch = launch
+        self.boot = boot
+        self.shutdown = shutdown
+        self.latency = latency
+        self.jitter = jitter
+
+    def jittered(self, value):
+        return max(0., value * random.uniform(1. - self.jitter,
+                                              1. + self.jitter))
+
+
+class FakeVM(object):
+    def __init__(self, name, timings):
+        self.id = str(uuid.uuid4())
+        self.name = name
+        self._timings = timings
+        self._lock = threading.Lock()
+        self._steps = [(0., 'down')]
+
+    @property
+    def state(self):
+        now = time.time()
+        with self._lock:
+            st = self._steps[0][1]
+            for when, step in self._steps:
+                if when > now:
+                    break
+                st = step
+            return st
+
+    def start(self):
+        st = self.state
+        if st not in ('down', 'powering_down'):
+            return False
+        t = self._timings
+        now = time.time()
+        launched = now + t.jittered(t.launch)
+        with self._lock:
+            self._steps = [(now, 'wait_for_launch'),
+                           (launched, 'powering_up'),
+                           (launched + t.jittered(t.boot), 'up')]
+        return True
+
+    def stop(self):
+        if self.state == 'down':
+            return False
+        t = self._timings
+        now = time.time()
+        with self._lock:
+            self._steps = [(now, 'powering_down'),
+                           (now + t.jittered(t.shutdown), 'down')]
+        return True
+
+    def to_xml(self, prefix):
+        return ('<vm href="%(prefix)s/vms/%(id)s" id="%(id)s">'
+                '<name>%(name)s</name>'
+                '<status><state>%(state)s</state></status>'
+                '</vm>') % {'prefix': prefix,
+                            'id': self.id,
+                            'name': escape(self.name),
+                            'state': self.state}
+
+
+class Engine(object):
+    def __init__(self, names, timings, prefix='/api'):
+        self.prefix = prefix
+        self.timings = timings
+        self._vms = [FakeVM(name, timings) for name in names]
+        self._by_id = dict((vm.id, vm) for vm in self._vms)
+
+    def get(self, vm_id):
+        return self._by_id.get(vm_id)
+
+    def search(self, query):
+        """
+        Supports the subset of the engine search syntax the harness
+        uses: name=PATTERN clauses (with * wildcards) joined by 'or'.
+        """
+        if not query:
+            return list(self._vms)
+        patterns = []
+        for clause in re.split(r'\s+or\s+', query.strip(), flags=re.I):
+            key, _, value = clause.partition('=')
+            if key.strip().lower() != 'name':
+                continue
+            patterns.append(value.strip())
+        return [vm for vm in self._vms
+                if any(fnmatch.fnmatchcase(vm.name, p) for p in patterns)]
+
+
+_ENTRY_POINT = ('<api>'
+                '<link href="%(prefix)s/vms" rel="vms"/>'
+                '<link href="%(prefix)s/vms?search={query}" rel="vms/search"/>'
+                '<product_info><name>fakeengine</name>'
+                '<version major="3" minor="6" build="0" revision="0"/>'
+                '</product_info>'
+                '</api>')
+
+_ACTION = ('<action><status><state>complete</state></status></action>')
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    @property
+    def engine(self):
+        return self.server.engine
+
+    def log_message(self, fmt, *args):
+        logging.debug('%s - %s', self.address_string(), fmt % args)
+
+    def _reply(self, code, body=''):
+        timings = self.engine.timings
+        time.sleep(timings.jittered(timings.latency))
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Set-Cookie', 'JSESSIONID=fakeengine; Path=/api')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _path(self):
+        url = urlparse.urlparse(self.path)
+        prefix = self.engine.prefix
+        if not url.path.startswith(prefix):
+            return None, None
+        path = url.path[len(prefix):].strip('/')
+        query = urlparse.parse_qs(url.query)
+        return path.split('/') if path else [], query
+
+    def do_GET(self):
+        path, query = self._path()
+        if path is None:
+            self._reply(404)
+        elif not path:
+            self._reply(200, _ENTRY_POINT % {'prefix': self.engine.prefix})
+        elif path == ['vms']:
+            search = urllib.unquote(query.get('search', [''])[0])
+            self._reply(200, '<vms>%s</vms>' % ''.join(
+                vm.to_xml(self.engine.prefix)
+                for vm in self.engine.search(search)))
+        elif len(path) == 2 and path[0] == 'vms':
+            vm = self.engine.get(path[1])
+            if vm is None:
+                self._reply(404)
+            else:
+                self._reply(200, vm.to_xml(self.engine.prefix))
+        else:
+            self._reply(404)
+
+    def do_POST(self):
+        size = int(self.headers.getheader('Content-Length', 0))
+        if size:
+            self.rfile.read(size)
+        path, _ = self._path()
+        if path is None or len(path) != 3 or path[0] != 'vms':
+            self._reply(404)
+            return
+        vm = self.engine.get(path[1])
+        action = getattr(vm, path[2], None) if path[2] in ('start',
+                                                          'stop') else None
+        if action is None:
+            self._reply(404)
+        elif action():
+            self._reply(200, _ACTION)
+        else:
+            self._reply(409, '<fault><reason>Operation Failed</reason>'
+                             '<detail>[Cannot %s VM. VM %s is %s.]</detail>'
+                             '</fault>' % (path[2], escape(vm.name),
+                                           vm.state))
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, address, engine):
+        HTTPServer.__init__(self, address, Handler)
+        self.engine = engine
+
+
+def _main():
+    parser = argparse.ArgumentParser(description='fake oVirt engine')
+    parser.add_argument('-a', '--address', help='address to bind [localhost]',
+                        type=str, default='localhost')
+    parser.add_argument('-p', '--port', help='port to listen on [8080]',
+                        type=int, default=8080)
+    parser.add_argument('-n', '--num-vms', help='number of VMs [32]',
+                        type=int, default=32)
+    parser.add_argument('-N', '--vm-name',
+                        help='VM name format, taking the VM index [Tiny%%i]',
+                        type=str, default='Tiny%i')
+    parser.add_argument('--launch', help='seconds in wait_for_launch [0.5]',
+                        type=float, default=0.5)
+    parser.add_argument('--boot', help='seconds in powering_up [5.0]',
+                        type=float, default=5.0)
+    parser.add_argument('--shutdown', help='seconds in powering_down [2.0]',
+                        type=float, default=2.0)
+    parser.add_argument('--latency', help='seconds per request [0.01]',
+                        type=float, default=0.01)
+    parser.add_argument('--jitter',
+                        help='relative jitter of every delay [0.1]',
+                        type=float, default=0.1)
+    parser.add_argument('-d', '--debug', help='log every request',
+                        action='store_true')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+
+    timings = Timings(args.launch, args.boot, args.shutdown,
+                      args.latency, args.jitter)
+    engine = Engine([args.vm_name % i for i in range(args.num_vms)], timings)
+    server = Server((args.address, args.port), engine)
+    logging.info('serving %i VMs on http://%s:%i%s',
+                 args.num_vms, args.address, args.port, engine.prefix)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    _main()
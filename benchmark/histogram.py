@@ -0,0 +1,80 @@
+"""
+HDR-style latency histogram.
+
+Values are counted in log-linear buckets: every power of two is split
+in `2 ** precision' linear sub-buckets, so any value is reproduced
+within 1 / 2 ** precision relative error, with memory bounded by the
+dynamic range instead of the number of samples. Histograms from
+different runs can be merged losslessly.
+"""
+
+import math
+
+
+class Histogram(object):
+    def __init__(self, lowest=1e-3, precision=7):
+        self._lowest = lowest
+        self._sub = 1 << precision
+        self._counts = {}
+        self._count = 0
+        self._total = 0.
+        self._min = None
+        self._max = None
+
+    def _index(self, value):
+        scaled = max(value / self._lowest, 1.)
+        exp = int(math.floor(math.log(scaled, 2)))
+        sub = int((scaled / (1 << exp) - 1.) * self._sub)
+        return exp * self._sub + min(sub, self._sub - 1)
+
+    def _value(self, index):
+        """Highest value counted in the bucket `index'."""
+        exp, sub = divmod(index, self._sub)
+        return (1 << exp) * (1. + (sub + 1.) / self._sub) * self._lowest
+
+    def record(self, value, count=1):
+        idx = self._index(value)
+        self._counts[idx] = self._counts.get(idx, 0) + count
+        self._count += count
+        self._total += value * count
+        self._min = value if self._min is None else min(self._min, value)
+        self._max = value if self._max is None else max(self._max, value)
+
+    def merge(self, other):
+        for idx, count in other._counts.items():
+            self._counts[idx] = self._counts.get(idx, 0) + count
+        self._count += other._count
+        self._total += other._total
+        for value in (other._min, other._max):
+            if value is not None:
+                self._min = value if self._min is None else min(self._min,
+                                                                value)
+                self._max = value if self._max is None else max(self._max,
+                                                                value)
+
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def mean(self):
+        return self._total / self._count if self._count else None
+
+    @property
+    def min(self):
+        return self._min
+
+    @property
+    def max(self):
+        return self._max
+
+    def percentile(self, pct):
+        if not self._count:
+            return None
+        rank = max(1, int(math.ceil(pct / 100. * self._count)))
+        seen = 0
+        for idx in sorted(self._counts):
+            seen += self._counts[idx]
+            if seen >= rank:
+                return min(self._value(idx), self._max)
+        return self._max
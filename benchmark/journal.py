@@ -0,0 +1,89 @@
+"""
+Durable record of the benchmark runs.
+
+The journal is a text file with one JSON object per line: first the
+configuration of the benchmark, then the results of each run, written
+and fsync'd as soon as the run completes. A benchmark interrupted
+midway can be resumed from the journal, skipping the completed runs.
+"""
+
+import json
+import logging
+import os
+
+
+class JournalError(Exception):
+    """The journal can't be used for this benchmark"""
+
+
+class Journal(object):
+    def __init__(self, path, config):
+        self._path = path
+        # as it will read back from the file
+        self._config = json.loads(json.dumps(config))
+        self._out = None
+        self._valid = 0
+        self._has_config = False
+
+    def load(self):
+        """
+        Returns a dict run index -> results for the completed runs.
+        A torn last line, left by a crash during a write, is ignored.
+        """
+        runs = {}
+        self._valid = 0
+        self._has_config = False
+        with open(self._path, 'rt') as src:
+            for lineno, line in enumerate(iter(src.readline, ''), 1):
+                try:
+                    if not line.endswith('\n'):
+                        raise ValueError('missing newline')
+                    entry = json.loads(line)
+                except ValueError:
+                    logging.warning('journal: %s:%i is truncated, ignored',
+                                    self._path, lineno)
+                    break
+                self._valid = src.tell()
+                if 'config' in entry:
+                    if entry['config'] != self._config:
+                        raise JournalError(
+                            'journal %s is for a different benchmark: %s' % (
+                                self._path, entry['config']))
+                    self._has_config = True
+                else:
+                    runs[entry['run']] = entry['results']
+        logging.info('journal: %i completed runs in %s',
+                     len(runs), self._path)
+        return runs
+
+    def open(self, resume=False):
+        if resume and os.path.exists(self._path):
+            runs = self.load()
+            self._out = open(self._path, 'r+t')
+            # drop whatever follows the last complete entry
+            self._out.truncate(self._valid)
+            self._out.seek(self._valid)
+            if not self._has_config:
+                # torn within the config line: without it, any later
+                # resume would accept any benchmark
+                logging.warning('journal: %s has no config, rewritten',
+                                self._path)
+                self._write({'config': self._config})
+        else:
+            runs = {}
+            self._out = open(self._path, 'wt')
+            self._write({'config': self._config})
+        return runs
+
+    def append(self, run, results):
+        self._write({'run': run, 'results': results})
+
+    def _write(self, entry):
+        self._out.write('%s\n' % json.dumps(entry))
+        self._out.flush()
+        os.fsync(self._out.fileno())
+
+    def close(self):
+        if self._out is not None:
+            self._out.close()
+            self._out = None
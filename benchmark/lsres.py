@@ -1,7 +1,8 @@
 #!/usr/bin/env python3.4
 
 import sys
-from statistics import mean, stdev
+from math import ceil
+from statistics import mean, median, stdev
 
 def parse(path):
     with open(path) as src:
@@ -12,14 +13,23 @@ def parse(path):
             res[vm] = [ float(v) for v in items ]
         return res
 
+def percentile(run, pct):
+    # nearest rank; `run' must be sorted
+    return run[max(0, ceil(pct / 100. * len(run)) - 1)]
+
 def show(src, res):
     tot = []
     for run in zip(*res.values()):
-        run = sorted(run)
-        x = (mean(run), run[0], run[-1], sum(run))
+        # VMs which did not come up in this run are 'nan'
+        run = sorted(v for v in run if v == v)
+        if not run:
+            continue
+        x = (mean(run), median(run),
+             percentile(run, 90), percentile(run, 99),
+             run[0], run[-1], sum(run))
         tot.append(x)
     data = list(zip(*tot))
-    desc = ('mean', 'best', 'worst', 'total')
+    desc = ('mean', 'median', 'p90', 'p99', 'best', 'worst', 'total')
     print("%s:" % src)
     for x, d in zip(data, desc):
         m = mean(x)
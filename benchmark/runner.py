@@ -0,0 +1,60 @@
+"""
+Runs VM operations concurrently on a bounded set of threads.
+
+Threads share the caller's API object, hence its connection pool,
+so nothing gets forked or pickled per VM.
+"""
+
+import logging
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+from clock import monotonic
+
+
+class RateLimiter(object):
+    """
+    Lets at most `rate' calls per second through, spacing them evenly.
+    """
+    def __init__(self, rate):
+        self._interval = 1. / rate
+        self._next = monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self._interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class Runner(object):
+    def __init__(self, concurrency=32, rate=None, initializer=None):
+        self._concurrency = concurrency
+        self._limiter = RateLimiter(rate) if rate else None
+        self._pool = ThreadPool(concurrency, initializer)
+        logging.info('runner: %i workers, rate limit: %s',
+                     concurrency, '%.1f/s' % rate if rate else 'none')
+
+    def _call(self, func, item):
+        if self._limiter is not None:
+            self._limiter.acquire()
+        try:
+            return func(item)
+        except Exception:
+            logging.exception('runner: %s(%s) failed',
+                              getattr(func, '__name__', func), item)
+            return None
+
+    def submit(self, func, item):
+        return self._pool.apply_async(self._call, (func, item))
+
+    def map(self, func, items):
+        return self._pool.map(lambda item: self._call(func, item), items)
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
@@ -0,0 +1,90 @@
+"""
+Engine connections shared by all the benchmark code.
+
+Every thread gets its own API object, created (and thus logged in)
+the first time that thread needs it, and reused afterwards across
+all the runs. Authentication is persistent, so the engine sees one
+login per worker, and the SDK keeps its HTTP connections alive.
+The time spent setting up the connections is tracked separately,
+so it doesn't pollute the VM startup numbers.
+VM names are resolved to ids once, the ids are kept for all the runs,
+or until no VM is found by its id, e.g. when recreated.
+"""
+
+import logging
+import threading
+
+from ovirtsdk.api import API
+
+from clock import monotonic
+
+
+class Session(object):
+    def __init__(self, url, username, password, **kwargs):
+        self._url = url
+        self._username = username
+        self._password = password
+        self._kwargs = kwargs
+        self._kwargs.setdefault('persistent_auth', True)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._apis = []
+        self._setup_times = []
+        self._ids = {}
+
+    @property
+    def api(self):
+        api = getattr(self._local, 'api', None)
+        if api is None:
+            api = self._connect()
+            self._local.api = api
+        return api
+
+    def vm_id(self, name):
+        """The id of the VM `name', None if not resolved yet."""
+        with self._lock:
+            return self._ids.get(name)
+
+    def remember_vm(self, name, vm_id):
+        with self._lock:
+            self._ids[name] = vm_id
+
+    def forget_vm(self, name, vm_id):
+        """Drops the id of the VM `name', if still `vm_id'."""
+        with self._lock:
+            if self._ids.get(name) == vm_id:
+                del self._ids[name]
+
+    @property
+    def setup_times(self):
+        with self._lock:
+            return list(self._setup_times)
+
+    def _connect(self):
+        begin = monotonic()
+        api = API(url=self._url,
+                  username=self._username,
+                  password=self._password,
+                  **self._kwargs)
+        elapsed = monotonic() - begin
+        logging.info('session: connected to %s in %.3fs (%s)',
+                     self._url, elapsed, threading.current_thread().name)
+        with self._lock:
+            self._apis.append(api)
+            self._setup_times.append(elapsed)
+        return api
+
+    def report(self):
+        times = self.setup_times
+        if times:
+            logging.info('session: %i connections, setup mean %.3fs max %.3fs',
+                         len(times), sum(times) / len(times), max(times))
+
+    def close(self):
+        with self._lock:
+            apis, self._apis = self._apis, []
+        for api in apis:
+            try:
+                api.disconnect()
+            except Exception as exc:
+                logging.warning('session: disconnect failed: %s', str(exc))
@@ -0,0 +1,110 @@
+"""
+Open-loop workloads: VMs are started at a configured arrival rate,
+regardless of how fast the engine serves them.
+
+A schedule is a comma-separated list of phases, each one either
+  RATExSECS       constant RATE VMs/s for SECS seconds
+  FROM-TOxSECS    rate ramping linearly from FROM to TO VMs/s
+e.g. '5x60,20x30' or '1-20x120,20x60'.
+"""
+
+import logging
+import math
+import threading
+import time
+
+from clock import monotonic
+
+
+def parse_schedule(spec):
+    schedule = []
+    for phase in spec.split(','):
+        rates, _, secs = phase.strip().partition('x')
+        low, _, high = rates.partition('-')
+        low = float(low)
+        high = float(high) if high else low
+        secs = float(secs)
+        if low < 0 or high < 0 or secs <= 0:
+            raise ValueError('invalid workload phase: %s' % phase)
+        schedule.append((low, high, secs))
+    return schedule
+
+
+def arrivals(schedule):
+    """
+    Yields the arrival offsets, in seconds from the workload start.
+    The k-th arrival of a phase happens when the integral of the rate
+    over the phase reaches k.
+    """
+    base = 0.
+    for low, high, secs in schedule:
+        accel = (high - low) / (2. * secs)
+        total = (low + high) / 2. * secs
+        k = 0
+        while k < total:
+            if accel == 0:
+                offset = k / low
+            else:
+                offset = (-low + math.sqrt(low * low + 4. * accel * k)) / (
+                    2. * accel)
+            yield base + offset
+            k += 1
+        base += secs
+
+
+def phase_windows(schedule):
+    base = 0.
+    for low, high, secs in schedule:
+        yield low, high, base, base + secs
+        base += secs
+
+
+class Dispatcher(threading.Thread):
+    """
+    Hands the VMs to the runner at the scheduled arrival times.
+    Arrivals are marked on the VMs, and the workers mark when they
+    actually pick a VM up, so queueing delay and service time can be
+    told apart.
+    """
+    def __init__(self, vms, runner, schedule, func):
+        threading.Thread.__init__(self, name='dispatcher')
+        self.daemon = True
+        self._vms = vms
+        self._runner = runner
+        self._schedule = schedule
+        self._func = func
+        self.begin = None
+
+    def run(self):
+        self.begin = monotonic()
+        for vm, offset in zip(self._vms, arrivals(self._schedule)):
+            delay = self.begin + offset - monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            vm.arrive(self.begin + offset)
+            self._runner.submit(self._func, vm)
+        logging.info('dispatcher: all arrivals submitted')
+
+
+def report(vms, schedule, begin):
+    arrived = [vm for vm in vms if vm.reached('arrived')]
+    done = [vm for vm in arrived if vm.reached('up')]
+    if not done:
+        logging.warning('workload: no VM came up')
+        return
+    queueing = sorted(vm.interval('arrived', 'dispatched') for vm in done)
+    service = sorted(vm.interval('dispatched', 'up') for vm in done)
+    for label, values in (('queueing delay', queueing),
+                          ('service time', service)):
+        logging.info('workload: %s: mean %.3fs median %.3fs max %.3fs',
+                     label, sum(values) / len(values),
+                     values[len(values) // 2], values[-1])
+    ups = sorted(vm.when('up') - begin for vm in done)
+    for low, high, first, last in phase_windows(schedule):
+        count = sum(1 for t in ups if first <= t < last)
+        logging.info('workload: phase %.1f-%.1f VMs/s [%.0fs-%.0fs]: '
+                     '%.2f VMs/s up', low, high, first, last,
+                     count / (last - first))
+    logging.info('workload: %i/%i VMs up, sustained %.2f VMs/s',
+                 len(done), len(arrived),
+                 len(done) / max(ups[-1], 1e-6))
@@ -0,0 +1,30 @@
+"""
+Monotonic clock, also on python versions lacking time.monotonic.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import time
+
+
+try:
+    monotonic = time.monotonic
+except AttributeError:
+    CLOCK_MONOTONIC = 1
+
+    class _Timespec(ctypes.Structure):
+        _fields_ = [('tv_sec', ctypes.c_long),
+                    ('tv_nsec', ctypes.c_long)]
+
+    _librt = ctypes.CDLL(ctypes.util.find_library('rt') or 'librt.so.1',
+                         use_errno=True)
+    _clock_gettime = _librt.clock_gettime
+    _clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_Timespec)]
+
+    def monotonic():
+        ts = _Timespec()
+        if _clock_gettime(CLOCK_MONOTONIC, ctypes.byref(ts)) != 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        return ts.tv_sec + ts.tv_nsec * 1e-9
@@ -0,0 +1,265 @@
+"""
+Collects the samples a remote sampler streams over ssh, with `-o -'.
+
+The samples are written out as they come, so the memory use does not
+grow with the run, and summarized every few seconds in the log, so a
+broken run shows up in its first minute. Understands the JSON lines of
+capture.py and the CSV of vdsmmon.py.
+
+The streams of several hosts can then be merged in one timeline, on
+the local clock: the clock offset of every host is measured at start,
+NTP style, over an ssh connection of its own. Its round trips may not
+match the ones of the sampling connection; the offset is only known
+within half the quickest round trip, which is logged with it.
+"""
+
+import heapq
+import json
+import logging
+import pipes
+import subprocess
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+import samplefmt
+from clock import monotonic
+
+
+class JsonParser(object):
+    def parse(self, line):
+        """Returns (vdsm cpu, host cpu); None if unknown."""
+        record = json.loads(line)
+        return (record.get('vdsm_main', {}).get('cpu'),
+                record.get('host', {}).get('cpu'))
+
+
+class CsvParser(object):
+    """Needs the header line vdsmmon.py writes first."""
+    def __init__(self):
+        self._vdsm = None
+        self._host = []
+
+    def parse(self, line):
+        if line.startswith(samplefmt.CSV_HEADER):
+            columns = samplefmt.csv_columns(0, line)
+            self._vdsm = columns.index('vdsm.cpu')
+            self._host = [idx for idx, name in enumerate(columns)
+                          if name.startswith('host.cpu[')]
+            return None, None
+        if line.startswith('#') or self._vdsm is None:
+            return None, None
+        values = [float(value) for value in line.split(',')]
+        host = [values[idx] for idx in self._host]
+        return values[self._vdsm], sum(host) / len(host) if host else None
+
+
+class Window(object):
+    """Mean and peak of the samples since the last reset."""
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.total = 0.
+        self.peak = None
+
+    def add(self, value):
+        if value is None or value != value:
+            return
+        self.count += 1
+        self.total += value
+        self.peak = value if self.peak is None else max(self.peak, value)
+
+    def __str__(self):
+        if not self.count:
+            return 'n/a'
+        return 'mean %.1f%% max %.1f%%' % (self.total / self.count, self.peak)
+
+
+class Collector(threading.Thread):
+    """
+    Copies the lines of `feed' to `out', logging a summary every
+    `report' seconds, and warning if nothing comes for `stall' seconds.
+    Call stop() before the sampler is stopped, so that the end of the
+    stream is not reported as an error.
+    """
+    def __init__(self, host, feed, out, parser, report=30., stall=10.):
+        threading.Thread.__init__(self, name='collect-%s' % host)
+        self.daemon = True
+        self.host = host
+        self.rows = 0
+        self.out = out
+        self._feed = feed
+        self._parser = parser
+        self._report = report
+        self._stall = stall
+        self._vdsm = Window()
+        self._cpu = Window()
+        self._last = monotonic()
+        self._stopping = False
+        self._lines = 0
+        self._started = threading.Event()
+        self._finished = threading.Event()
+        self._watchdog = threading.Thread(target=self._watch,
+                                          name='watch-%s' % host)
+        self._watchdog.daemon = True
+
+    def start(self):
+        threading.Thread.start(self)
+        self._watchdog.start()
+
+    def stop(self):
+        self._stopping = True
+
+    def join(self, timeout=None):
+        threading.Thread.join(self, timeout)
+        # or python 2 may tear it down in the middle of a wait at exit
+        self._watchdog.join(timeout)
+
+    def wait_started(self, timeout):
+        """
+        Waits up to `timeout' seconds for the first line, which the
+        samplers write once they are ready to be stopped. Returns
+        False if it did not come.
+        """
+        self._started.wait(timeout)
+        return self._lines > 0
+
+    def run(self):
+        reported = monotonic()
+        try:
+            # not `for line in feed': its read-ahead delays the lines
+            for line in iter(self._feed.readline, ''):
+                self._last = monotonic()
+                self._lines += 1
+                self._started.set()
+                self.out.write(line)
+                try:
+                    vdsm, cpu = self._parser.parse(line)
+                except ValueError:
+                    continue  # torn line
+                if cpu is not None:
+                    self.rows += 1
+                    self._vdsm.add(vdsm)
+                    self._cpu.add(cpu)
+                if self._last - reported >= self._report:
+                    reported = self._last
+                    self.out.flush()
+                    self._summary()
+            self.out.flush()
+            self._summary()
+            if not self._stopping:
+                logging.error('%s: the sampler stream ended early, '
+                              'after %i samples', self.host, self.rows)
+        finally:
+            self._started.set()
+            self._finished.set()
+
+    def _summary(self):
+        logging.info('%s: %i samples; vdsm cpu %s, host cpu %s',
+                     self.host, self.rows, self._vdsm, self._cpu)
+        self._vdsm.reset()
+        self._cpu.reset()
+
+    def _watch(self):
+        while not self._finished.wait(self._stall):
+            idle = monotonic() - self._last
+            if idle >= self._stall:
+                logging.warning('%s: no samples for %i seconds',
+                                self.host, idle)
+
+
+# answers every line with the local time; runs on python 2 and 3
+_ECHO = ('import sys, time\n'
+         'for _ in iter(sys.stdin.readline, ""):\n'
+         '    sys.stdout.write("%.6f\\n" % time.time())\n'
+         '    sys.stdout.flush()\n')
+
+
+def clock_offset(host, rounds=8):
+    """
+    Returns (offset, error) in seconds of the clock of `host', ahead
+    of the local one, from the quickest of `rounds' round trips.
+    """
+    proc = subprocess.Popen(['ssh', host, 'python', '-c', pipes.quote(_ECHO)],
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    best = None
+    try:
+        for _ in range(rounds):
+            begin = time.time()
+            proc.stdin.write('\n')
+            proc.stdin.flush()
+            remote = float(proc.stdout.readline())
+            end = time.time()
+            if best is None or end - begin < best[0]:
+                best = (end - begin, remote - (begin + end) / 2.)
+    finally:
+        proc.stdin.close()
+        proc.wait()
+    return best[1], best[0] / 2.
+
+
+def clock_offsets(hosts):
+    """Returns {host: (offset, error)}, measured on all hosts at once."""
+    pool = ThreadPool(len(hosts))
+    try:
+        offsets = dict(zip(hosts, pool.map(clock_offset, hosts)))
+    finally:
+        pool.close()
+        pool.join()
+    for host in hosts:
+        logging.info('%s: clock offset %+.3fs (+/- %.3fs)',
+                     host, *offsets[host])
+    return offsets
+
+
+def samples(path):
+    """
+    Yields the records of a capture.py or vdsmmon.py file, skipping
+    comments and torn lines.
+    """
+    columns = None
+    with open(path, 'rt') as src:
+        for line in src:
+            if line.startswith(samplefmt.CSV_HEADER):
+                columns = samplefmt.csv_columns(0, line)
+                continue
+            if line.startswith('#'):
+                continue
+            try:
+                if columns is None:
+                    yield json.loads(line)
+                else:
+                    values = [float(value) for value in line.split(',')]
+                    if len(values) == len(columns):
+                        yield samplefmt.unflatten(columns, [
+                            None if value != value else value
+                            for value in values])
+            except ValueError:
+                continue
+
+
+def _timeline(host, path, offset):
+    for seq, record in enumerate(samples(path)):
+        record['timestamp'] -= offset
+        record['source'] = host
+        yield record['timestamp'], host, seq, record
+
+
+def merge(sources, path):
+    """
+    Merges the samples of `sources', [(host, path, clock offset)],
+    into one JSON lines file, ordered by time on the local clock.
+    Every record gets the name of its host as 'source'. The files are
+    read as they are merged, so memory use does not grow with them.
+    Returns the samples count.
+    """
+    count = 0
+    with open(path, 'wt') as out:
+        for _, _, _, record in heapq.merge(*[
+                _timeline(host, src, offset)
+                for host, src, offset in sources]):
+            out.write('%s\n' % json.dumps(record))
+            count += 1
+    return count
@@ -0,0 +1,332 @@
+#!/usr/bin/env python
+"""
+Compact binary format for sample streams.
+
+  magic    8 bytes   'OVSMPL01'
+  size     4 bytes   little endian size of the header
+  header   JSON {"columns": [...], "types": [...], "meta": {...}},
+           space-padded so the rows start 8-byte aligned
+  rows     packed little endian values, one per column, with the
+           struct type of the column
+  trailer  8 bytes 'OVSMPLND' plus the row count as little endian
+           64 bit integer, written on clean close only
+
+Columns are named after the JSON records: 'vdsm_main.cpu' is
+record['vdsm_main']['cpu'], and 'libvirtd.memory[1]' is
+record['libvirtd']['memory'][1]. Timestamps are stored as doubles,
+memory sizes as bytes in 64 bits, counts like threads in 32 bits,
+everything else as floats. Missing values are NaN, or the maximum
+value for integer columns.
+All the columns are declared in the header: a record with more of them
+can't be written.
+
+Files without trailer, e.g. from a killed sampler, are still readable:
+the rows are counted from the file size, and a torn last row is dropped.
+The rows can be memory mapped as a numpy record array.
+Run as a script to convert to and from the JSON and CSV formats.
+"""
+
+import json
+import os
+import re
+import struct
+import sys
+
+
+MAGIC = b'OVSMPL01'
+TRAILER = b'OVSMPLND'
+_SIZE = struct.Struct('<I')
+_COUNT = struct.Struct('<Q')
+_ITEM = re.compile(r'^(.*)\[(\d+)\]$')
+_NAN = float('nan')
+_MISSING = {'d': _NAN, 'f': _NAN, 'I': 0xffffffff,
+            'Q': 0xffffffffffffffff}
+_DTYPES = {'d': '<f8', 'f': '<f4', 'I': '<u4', 'Q': '<u8'}
+_INTEGERS = ('I', 'Q')
+
+
+# columns holding counts, stored as integers
+_COUNTS = re.compile(r'^missed$|\.(count|fds|threads)$')
+
+
+def column_type(column):
+    """Returns the struct type used to store `column'."""
+    if column == 'timestamp':
+        return 'd'
+    if '.memory[' in column:
+        # the qemu totals of a big host overflow 32 bits
+        return 'Q'
+    if _COUNTS.search(column):
+        return 'I'
+    return 'f'
+
+
+def _is_number(value):
+    return (isinstance(value, (int, long, float)) and
+            not isinstance(value, bool))
+
+
+def flatten(record, prefix=''):
+    """Yields (column, value) for every number in `record'."""
+    for key in sorted(record):
+        value = record[key]
+        name = prefix + key
+        if isinstance(value, dict):
+            for item in flatten(value, name + '.'):
+                yield item
+        elif isinstance(value, (list, tuple)):
+            # lists of non numbers, like the top threads, don't fit
+            # a fixed schema and are left out
+            for idx, item in enumerate(value):
+                if _is_number(item):
+                    yield '%s[%i]' % (name, idx), item
+        elif _is_number(value):
+            yield name, value
+
+
+def unflatten(columns, row):
+    record = {}
+    for column, value in zip(columns, row):
+        if value is None:
+            continue
+        path = column.split('.')
+        node = record
+        for key in path[:-1]:
+            node = node.setdefault(key, {})
+        match = _ITEM.match(path[-1])
+        if match is None:
+            node[path[-1]] = value
+        else:
+            seq = node.setdefault(match.group(1), [])
+            idx = int(match.group(2))
+            seq.extend([None] * (idx + 1 - len(seq)))
+            seq[idx] = value
+    return record
+
+
+class Writer(object):
+    def __init__(self, out, columns, meta=None, types=None):
+        """
+        `types' are the struct types of the `columns', after
+        column_type() if not given.
+        """
+        self._out = out
+        self._columns = list(columns)
+        self._index = dict((c, i) for i, c in enumerate(self._columns))
+        if types is None:
+            types = [column_type(c) for c in self._columns]
+        types = list(types)
+        self._missing = [_MISSING[t] for t in types]
+        self._integers = [t in _INTEGERS for t in types]
+        self._row = struct.Struct('<' + ''.join(types))
+        self.rows = 0
+        header = json.dumps({'columns': self._columns,
+                             'types': types,
+                             'meta': meta or {}})
+        pad = -(len(MAGIC) + _SIZE.size + len(header)) % 8
+        header += ' ' * pad
+        out.write(MAGIC + _SIZE.pack(len(header)) + header.encode('utf-8'))
+
+    @property
+    def columns(self):
+        return self._columns
+
+    def write(self, values):
+        """`values' are one per column, None or NaN if missing."""
+        self._out.write(self._row.pack(*[
+            missing if value is None or value != value else
+            (int(value) if integer else value)
+            for value, missing, integer in zip(
+                values, self._missing, self._integers)]))
+        self.rows += 1
+
+    def write_record(self, record):
+        """
+        Raises ValueError if `record' has columns not declared when
+        the writer was created.
+        """
+        values = [None] * len(self._columns)
+        for column, value in flatten(record):
+            idx = self._index.get(column)
+            if idx is None:
+                raise ValueError('undeclared column: %s' % column)
+            values[idx] = value
+        self.write(values)
+
+    def flush(self):
+        self._out.flush()
+
+    def close(self):
+        self._out.write(TRAILER + _COUNT.pack(self.rows))
+        self._out.flush()
+
+
+class Reader(object):
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as src:
+            if src.read(len(MAGIC)) != MAGIC:
+                raise ValueError('%s: not a sample file' % path)
+            size, = _SIZE.unpack(src.read(_SIZE.size))
+            header = json.loads(src.read(size).decode('utf-8'))
+        self.columns = header['columns']
+        self.types = header['types']
+        self.meta = header['meta']
+        self.offset = len(MAGIC) + _SIZE.size + size
+        self._row = struct.Struct('<' + ''.join(self.types))
+        self.complete, self.rows = self._count()
+
+    def _count(self):
+        size = os.path.getsize(self.path) - self.offset
+        tail = len(TRAILER) + _COUNT.size
+        if size >= tail:
+            with open(self.path, 'rb') as src:
+                src.seek(-tail, os.SEEK_END)
+                data = src.read(tail)
+            if data.startswith(TRAILER):
+                rows, = _COUNT.unpack(data[len(TRAILER):])
+                if rows * self._row.size == size - tail:
+                    return True, rows
+        # no trailer: a partially written last row is ignored
+        return False, size // self._row.size
+
+    def _decode(self, value, kind):
+        if value != value or value == _MISSING[kind]:
+            return None
+        if kind == 'f':
+            # drop the float32 noise: samples have few digits anyway
+            return float('%.6g' % value)
+        return value
+
+    def __iter__(self):
+        """Yields the rows, as lists with None for missing values."""
+        with open(self.path, 'rb') as src:
+            src.seek(self.offset)
+            for _ in range(self.rows):
+                row = self._row.unpack(src.read(self._row.size))
+                yield [self._decode(value, kind)
+                       for value, kind in zip(row, self.types)]
+
+    def records(self):
+        for row in self:
+            yield unflatten(self.columns, row)
+
+    def load(self):
+        """
+        Maps the rows, without copying, as a record array with one
+        field per column; missing values are stored ones, see _MISSING.
+        """
+        import numpy
+        dtype = numpy.dtype([(str(c), _DTYPES[t])
+                             for c, t in zip(self.columns, self.types)])
+        if not self.rows:
+            # nothing to map
+            return numpy.zeros(0, dtype=dtype)
+        return numpy.memmap(self.path, dtype=dtype, mode='r',
+                            offset=self.offset, shape=(self.rows,))
+
+
+CSV_HEADER = '# columns='
+
+
+def csv_header(columns):
+    return CSV_HEADER + ','.join(columns)
+
+
+def csv_columns(width, header=None):
+    """
+    Columns of the CSV written by vdsmmon.py: from its `header' line,
+    or the layout of the files written before it had one.
+    """
+    if header is not None and header.startswith(CSV_HEADER):
+        return header[len(CSV_HEADER):].strip().split(',')
+    columns = ['timestamp']
+    for name in ('libvirtd', 'vdsm'):
+        columns += [name + '.cpu', name + '.memory[0]', name + '.memory[1]']
+    columns += ['host.cpu[%i]' % i for i in range(width - len(columns))]
+    return columns
+
+
+def csv_rows(feed):
+    """
+    Yields the rows of a csv.reader, skipping comments and a torn
+    last row, left by a killed sampler.
+    """
+    width = None
+    for row in feed:
+        if not row or row[0].startswith('#'):
+            continue
+        if width is None:
+            width = len(row)
+        elif len(row) != width:
+            continue
+        yield row
+
+
+def json2bin(src, dst):
+    # processes come and go: the columns are the ones of all the records
+    columns = set()
+    with open(src, 'rt') as inp:
+        for line in inp:
+            columns.update(c for c, _ in flatten(json.loads(line)))
+    with open(src, 'rt') as inp:
+        with open(dst, 'wb') as out:
+            writer = Writer(out, sorted(columns),
+                            {'source': os.path.basename(src)})
+            for line in inp:
+                writer.write_record(json.loads(line))
+            writer.close()
+
+
+def bin2json(src, dst):
+    with open(dst, 'wt') as out:
+        for record in Reader(src).records():
+            out.write('%s\n' % json.dumps(record))
+
+
+def csv2bin(src, dst):
+    with open(src, 'rt') as inp:
+        header = inp.readline()
+        if not header.startswith(CSV_HEADER):
+            header = None
+            inp.seek(0)
+        rows = ([float(v) for v in line.split(',')]
+                for line in inp if not line.startswith('#'))
+        first = next(rows)
+        with open(dst, 'wb') as out:
+            writer = Writer(out, csv_columns(len(first), header),
+                            {'source': os.path.basename(src)})
+            writer.write(first)
+            for row in rows:
+                writer.write(row)
+            writer.close()
+
+
+def bin2csv(src, dst):
+    reader = Reader(src)
+    with open(dst, 'wt') as out:
+        out.write('%s\n' % csv_header(reader.columns))
+        for row in reader:
+            out.write('%s\n' % ','.join(
+                'nan' if v is None else str(v) for v in row))
+
+
+_CONVERTERS = {
+    'json2bin': json2bin,
+    'bin2json': bin2json,
+    'csv2bin': csv2bin,
+    'bin2csv': bin2csv,
+}
+
+
+def _main():
+    args = sys.argv[1:]
+    if len(args) != 3 or args[0] not in _CONVERTERS:
+        print 'usage: samplefmt.py {%s} source dest' % ','.join(
+            sorted(_CONVERTERS))
+        sys.exit(1)
+    _CONVERTERS[args[0]](args[1], args[2])
+
+
+if __name__ == '__main__':
+    _main()
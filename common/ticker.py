@@ -0,0 +1,42 @@
+"""
+Fixed-rate scheduling for the samplers.
+
+The n-th tick is due at start + n * interval on the monotonic clock,
+however long the work between ticks takes, so the sampling rate does
+not drift. Ticks whose whole slot went by while the sampler was busy
+are skipped and reported, instead of being silently lost.
+"""
+
+import time
+
+from clock import monotonic
+
+
+class Ticker(object):
+    def __init__(self, interval):
+        self.interval = interval
+        self.missed = 0
+        self._start = None
+        self._tick = 0
+
+    def wait(self):
+        """
+        Sleeps until the next tick is due; the first tick is due
+        immediately. Returns how many ticks were skipped since the
+        previous one.
+        """
+        now = monotonic()
+        if self._start is None:
+            self._start = now
+            return 0
+        self._tick += 1
+        due = self._start + self._tick * self.interval
+        missed = 0
+        if now - due >= self.interval:
+            missed = int((now - due) / self.interval)
+            self._tick += missed
+            due += missed * self.interval
+            self.missed += missed
+        if due > now:
+            time.sleep(due - now)
+        return missed
@@ -4,10 +4,15 @@ import csv
 import argparse
 from collections import defaultdict
 import logging
+import os.path
 import subprocess
 import sys
 import time
 
+# modules shared by all the tools, see common/
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                os.pardir, 'common'))
+import collect
 from ovirtsdk.xml import params
 from ovirtsdk.api import API
 
@@ -98,43 +103,88 @@ def idle(secs_, chunk=10):
         elapsed += chunk
 
 
-def monitor(host, action, args, workdir='$HOME', path=''):
-    subprocess.call(['ssh', host,
-                      'PATH=$PATH:'+ path, 'vdsmmon.py', '-D',
-                      '-o', workdir + '/test.csv',
-                      '-p', workdir +  '/mon.pid'])
-
-    action(*args)
-
-    subprocess.call(['ssh', host,
-                     'kill', '-USR1',
-                     '$(', 'cat', workdir + '/mon.pid', ')'])
-    data = subprocess.check_output(['ssh', host,
-                                    'cat', 'test.csv'])
-    subprocess.call(['ssh', host,
-                     'rm', 'test.csv', 'mon.pid'])
-    return data
-
-
-def bench(host, name, first, last, api, outfile, delay=None):
+# seconds a sampler may take to write its first line
+_START_TIMEOUT = 30.
+
+
+def monitor(hosts, action, args, outfile, workdir='$HOME', path=''):
+    """
+    Runs `action' while sampling all the `hosts' at once; the samples
+    are streamed over ssh into `outfile' as they are taken. With more
+    than one host, every host gets its own '<outfile>.<host>' file, and
+    `outfile' gets their samples merged on the local clock, see
+    collect.merge. The action begins once all the samplers are ready.
+    Returns the samples count.
+    """
+    offsets = collect.clock_offsets(hosts)
+    if len(hosts) == 1:
+        outfiles = {hosts[0]: outfile}
+    else:
+        outfiles = dict((host, '%s.%s' % (outfile, host)) for host in hosts)
+    # hosts may share the home directory: one pid file per host and run
+    pidfiles = dict((host, '%s/mon.%s.%i.pid' % (workdir, host, os.getpid()))
+                    for host in hosts)
+    samplers, collectors = [], []
+    try:
+        for host in hosts:
+            sampler = subprocess.Popen(['ssh', host,
+                                        'PATH=$PATH:' + path, 'vdsmmon.py',
+                                        '-o', '-',
+                                        '-p', pidfiles[host]],
+                                       stdout=subprocess.PIPE)
+            samplers.append(sampler)
+            collector = collect.Collector(host, sampler.stdout,
+                                          open(outfiles[host], 'wb'),
+                                          collect.CsvParser())
+            collectors.append(collector)
+            collector.start()
+        for collector in collectors:
+            # the pid file is written before the first line: the
+            # sampler can be stopped from then on
+            if not collector.wait_started(_START_TIMEOUT):
+                raise RuntimeError('%s: the sampler did not start' %
+                                   collector.host)
+        action(*args)
+    finally:
+        for collector in collectors:
+            collector.stop()
+        for host in hosts[:len(samplers)]:
+            subprocess.call(['ssh', host,
+                             'kill', '-USR1',
+                             '$(', 'cat', pidfiles[host], ')'])
+        for sampler in samplers:
+            sampler.wait()
+        for collector in collectors:
+            collector.join()
+            collector.out.close()
+        for host in hosts[:len(samplers)]:
+            subprocess.call(['ssh', host,
+                             'rm', pidfiles[host]])
+    if len(hosts) > 1:
+        collect.merge([(host, outfiles[host], offsets[host][0])
+                       for host in hosts], outfile)
+    return sum(collector.rows for collector in collectors)
+
+
+def bench(hosts, name, first, last, api, outfile, delay=None):
     vms = [ VMHandle(api, i, name) for i in range(first, last) ]
     start(vms)
 #    wait(vms)
 
     begin = time.time()
-    data = monitor(host, idle, (delay,))
+    rows = monitor(hosts, idle, (delay,), outfile)
     end = time.time()
 
     stop(vms)
-    return data
+    return rows
 
 
 if __name__ == '__main__':
     if len(sys.argv) != 6:
-        print 'usage: host start stop mins outfile'
+        print 'usage: host[,host...] start stop mins outfile'
         sys.exit(1)
 
-    host = sys.argv[1]
+    hosts = sys.argv[1].split(',')
     first = int(sys.argv[2])
     last = int(sys.argv[3])
     mins = int(sys.argv[4])
@@ -145,7 +195,5 @@ if __name__ == '__main__':
               username='USER',
               password='PASS')
 
-    data = bench(host, 'SuperTiny_C%03i', first, last, api, outfile, mins * 60.)
-
-    with open(outfile, 'wb') as out:
-        out.write(data)
+    rows = bench(hosts, 'SuperTiny_C%03i', first, last, api, outfile, mins * 60.)
+    logging.info('%i samples saved in %s', rows, outfile)
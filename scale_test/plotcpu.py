@@ -2,28 +2,43 @@
 
 import csv
 import matplotlib.pyplot as plt
+import os.path
 import sys
 
+# modules shared by all the tools, see common/
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                os.pardir, 'common'))
+import samplefmt
+
 def avg(seq):
     return len(seq) * [sum(seq)/float(len(seq))]
 
-def times(seq):
-    return range(len(seq))
+def times(stamps):
+    return [ts - stamps[0] for ts in stamps]
 
 def cap(seq, cap=120.0):
     for i in seq:
         yield min(i, cap)
 
 
+def first_cpu(header):
+    """Index of the first host cpu column: vdsmmon.py names them."""
+    if header.startswith(samplefmt.CSV_HEADER):
+        return samplefmt.csv_columns(0, header).index('host.cpu[0]')
+    return 7
+
 def getdata(source):
     with open(source, 'rt') as src:
+        first = first_cpu(src.readline())
+        src.seek(0)
         feed = csv.reader(src)
-        libvirt, vdsm, cpus = [], [], []
-        for row in feed:
+        stamps, libvirt, vdsm, cpus = [], [], [], []
+        for row in samplefmt.csv_rows(feed):
+            stamps.append(float(row[0]))
             libvirt.append(float(row[1]))
             vdsm.append(float(row[4]))
-            cpus.append(tuple(float(x) for x in row[7:]))
-        return libvirt, vdsm, cpus
+            cpus.append(tuple(float(x) for x in row[first:]))
+        return stamps, libvirt, vdsm, cpus
 
 def percpu(cpus, i):
     return (cpu[i] for cpu in cpus)
@@ -34,11 +49,11 @@ def cpuusage(cpus):
 
 
 def draw(source, title):
-    libvirt, vdsm, cpus = getdata(source)
+    stamps, libvirt, vdsm, cpus = getdata(source)
+    t = times(stamps)
 
     plt.figure(1)
     plt.subplot(311)
-    t = times(libvirt)
     a = avg(libvirt)
     plt.plot(t, libvirt, 'g', t, a, 'k')
     plt.ylabel('libvirt cpu % - 100% is one core')
@@ -47,7 +62,6 @@ def draw(source, title):
     plt.grid(True)
 
     plt.subplot(312)
-    t = times(vdsm)
     a = avg(vdsm)
     plt.plot(t, list(cap(vdsm)), 'r', t, a, 'k')
     plt.ylabel('VDSM cpu % - 100% is one core')
@@ -55,7 +69,6 @@ def draw(source, title):
     plt.grid(True)
 
     plt.subplot(313)
-    t = times(cpus)
     u = list(cpuusage(cpus))
     a = avg(u)
     plt.plot(t, u, 'b', t, a, 'k')
@@ -2,19 +2,26 @@
 
 import csv
 import matplotlib.pyplot as plt
+import os.path
 import sys
 
-def times(seq):
-    return range(len(seq))
+# modules shared by all the tools, see common/
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                os.pardir, 'common'))
+import samplefmt
+
+def times(stamps):
+    return [ts - stamps[0] for ts in stamps]
 
 def getdata(source):
     with open(source, 'rt') as src:
         feed = csv.reader(src)
-        libvirt, vdsm = [], []
-        for row in feed:
+        stamps, libvirt, vdsm = [], [], []
+        for row in samplefmt.csv_rows(feed):
+            stamps.append(float(row[0]))
             libvirt.append((float(row[2]), float(row[3])))
             vdsm.append((float(row[5]), float(row[6])))
-        return libvirt, vdsm
+        return stamps, libvirt, vdsm
 
 def splitmem(mem):
     rss, vsz = [], []
@@ -24,11 +31,11 @@ def splitmem(mem):
     return rss, vsz
 
 def draw(source, title):
-    libvirt, vdsm = getdata(source)
+    stamps, libvirt, vdsm = getdata(source)
+    t = times(stamps)
 
     plt.figure(1)
     plt.subplot(211)
-    t = times(libvirt)
     r, v = splitmem(libvirt)
     plt.plot(#t, v, 'b',
              t, r, 'r')
@@ -38,7 +45,6 @@ def draw(source, title):
     plt.grid(True)
 
     plt.subplot(212)
-    t = times(vdsm)
     r, v = splitmem(vdsm)
     plt.plot(#t, v, 'b',
              t, r, 'r')
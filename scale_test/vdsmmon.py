@@ -8,6 +8,13 @@ import signal
 import sys
 import time
 
+# modules shared by all the tools, see common/
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                os.pardir, 'common'))
+import samplefmt
+from clock import monotonic
+from ticker import Ticker
+
 try:
     import psutil
 except ImportError:
@@ -28,6 +35,7 @@ except ImportError:
 
 
 _RUNDIR = '/var/run'
+_BUFSIZE = 64 * 1024
 
 
 class StopSampling(Exception):
@@ -61,31 +69,179 @@ def write_pid_file(pidfile):
         logging.error('savepid(%s) failed: %s', pidfile, str(exc))
 
 
+def columns(ncpus):
+    """
+    The sampler accounts for itself as 'vdsmmon': `latency' is the
+    time, in seconds, spent sampling and writing the previous tick.
+    """
+    names = ['timestamp']
+    for name in ('libvirtd', 'vdsm', 'vdsmmon'):
+        names += [name + '.cpu', name + '.memory[0]', name + '.memory[1]']
+    names.append('vdsmmon.latency')
+    names += ['host.cpu[%i]' % i for i in range(ncpus)]
+    return names
+
+
+def _usage(proc):
+    if proc is None:
+        return (None, None, None)
+    # newer psutil reports more than (rss, vms)
+    return (proc.cpu_percent(),) + tuple(proc.memory_info()[:2])
+
+
 def sampler(libvirtd, vdsm, delay=0.5):
+    """
+    Yields (missed, sample): `missed' is the number of ticks skipped
+    since the previous sample, because sampling took too long.
+    `libvirtd' and `vdsm' are None when calibrating, and sampled as
+    missing values.
+    """
+    procs = (libvirtd, vdsm, psutil.Process(os.getpid()))
     # see psutil docs. Discard the first one
-    libvirtd.cpu_percent()
-    vdsm.cpu_percent()
+    for proc in procs:
+        _usage(proc)
 
-    ts = 0.0
+    latency = 0.
+    ticker = Ticker(delay)
     while True:
         try:
-            yield (time.time(),
-                   libvirtd.cpu_percent()) + \
-                   libvirtd.memory_info() + \
-                   (vdsm.cpu_percent(),) + \
-                   vdsm.memory_info() + tuple(
-                   psutil.cpu_percent(percpu=True))
-            time.sleep(delay)
-            ts += delay
+            missed = ticker.wait()
+            begin = monotonic()
+            sample = (time.time(),)
+            for proc in procs:
+                sample += _usage(proc)
+            yield missed, (sample + (round(latency, 6),) +
+                           tuple(psutil.cpu_percent(percpu=True)))
+            # taken when the caller is done writing the sample
+            latency = monotonic() - begin
         except KeyboardInterrupt:
             break
         except StopSampling:
             break
 
 
-def _main(opts, libvirtd_pid, vdsm_pid):
-    libvirtd = psutil.Process(libvirtd_pid)
-    vdsm = psutil.Process(vdsm_pid)
+def _csv_value(val):
+    if val is None:
+        return 'nan'
+    if isinstance(val, float):
+        # str() keeps 12 digits: 10ms of a timestamp
+        return repr(val)
+    return str(val)
+
+
+class CsvWriter(object):
+    def __init__(self, out, columns):
+        self._out = out
+        self.rows = 0
+        self.missed = 0
+        self._out.write('%s\n' % samplefmt.csv_header(columns))
+
+    def write(self, values):
+        self._out.write('%s\n' % ','.join(_csv_value(val) for val in values))
+        self.rows += 1
+
+    def skip(self, missed):
+        # the plotting scripts skip comment lines
+        self._out.write('# missed=%i\n' % missed)
+        self.missed += missed
+
+    def close(self):
+        self._out.write('# end rows=%i missed=%i\n' % (self.rows,
+                                                       self.missed))
+
+
+class BinWriter(object):
+    """
+    Writes samplefmt files, with the same columns as the CSV files.
+    """
+    def __init__(self, out, columns):
+        self._writer = samplefmt.Writer(out, columns,
+                                        {'sampler': 'vdsmmon.py'})
+
+    def write(self, values):
+        self._writer.write(values)
+
+    def skip(self, missed):
+        # one empty row per missed tick, to keep the cadence
+        for _ in range(missed):
+            self._writer.write([None] * len(self._writer.columns))
+
+    def close(self):
+        self._writer.close()
+
+
+_WRITERS = {
+    'csv': CsvWriter,
+    'bin': BinWriter,
+}
+
+
+class Stream(object):
+    """
+    Writes the samples as they come: the buffered rows are flushed
+    every `flush_rows' rows, and the file is synced to disk at most
+    every `sync_secs' seconds. The trailer is written on close only,
+    so an interrupted file is recognizable, but still readable.
+    """
+    def __init__(self, out, writer, flush_rows=60, sync_secs=10.):
+        self._out = out
+        self._writer = writer
+        self._flush_rows = flush_rows
+        self._sync_secs = sync_secs
+        self._pending = 0
+        self._synced = time.time()
+
+    def _sync(self):
+        self._out.flush()
+        try:
+            os.fsync(self._out.fileno())
+        except OSError as exc:
+            # like /dev/null
+            logging.debug('fsync failed: %s', str(exc))
+        self._synced = time.time()
+
+    def write(self, values, missed=0):
+        if missed:
+            logging.warning('missed %i ticks', missed)
+            self._writer.skip(missed)
+        self._writer.write(values)
+        self._pending += 1
+        if self._pending >= self._flush_rows:
+            self._pending = 0
+            if time.time() - self._synced >= self._sync_secs:
+                self._sync()
+            else:
+                self._out.flush()
+
+    def close(self):
+        self._writer.close()
+        self._sync()
+
+
+def _sample(opts, libvirtd, vdsm, fmt, out, flush_rows):
+    writer = _WRITERS[fmt](out, columns(psutil.cpu_count()))
+    stream = Stream(out, writer,
+                    int(opts.get('-F', flush_rows)),
+                    float(opts.get('-s', 10.)))
+    try:
+        for missed, sp in sampler(libvirtd, vdsm,
+                                  float(opts.get('-i', 0.5))):
+            stream.write(sp, missed)
+    except (KeyboardInterrupt, StopSampling):
+        # the signal came while writing, not while sampling
+        pass
+    finally:
+        # a clean stop: the trailer tells the file is complete
+        stream.close()
+
+
+def _main(opts, libvirtd_pid=None, vdsm_pid=None):
+    libvirtd = vdsm = None
+    if libvirtd_pid is None:
+        logging.info('calibrating: sampling the host and vdsmmon only')
+    else:
+        libvirtd = psutil.Process(libvirtd_pid)
+        vdsm = psutil.Process(vdsm_pid)
 
     if '-p' in opts:
         write_pid_file(opts['-p'])
@@ -93,46 +249,63 @@ def _main(opts, libvirtd_pid, vdsm_pid):
     start = time.time()
     logging.info('begin sampling at %f', start)
 
-    samples = list(sampler(libvirtd, vdsm))
+    fmt = opts.get('-f', 'csv')
+    path = opts.get('-o', '/dev/null')
+    if path == '-':
+        # streaming, e.g. over ssh: every row goes out at once
+        _sample(opts, libvirtd, vdsm, fmt, sys.stdout, 1)
+    else:
+        with open(path, 'wb' if fmt == 'bin' else 'wt', _BUFSIZE) as out:
+            _sample(opts, libvirtd, vdsm, fmt, out, 60)
 
     stop = time.time()
     logging.info('end sampling at %f' % stop)
     logging.info('sampled for %i seconds' % int(stop - start))
 
-    with open(opts.get('-o', '/dev/null'), 'wt') as out:
-        for sp in samples:
-            out.write('%s\n' % ','.join(str(val) for val in sp))
-
 
 def usage():
     print '-h      this message'
+    print '-C      calibrate: sample only the host and vdsmmon itself,'
+    print '        to measure the baseline on an idle host'
     print '-D      became daemon'
-    print '-o file saves output stats to <file> [/dev/null]'
+    print '-f fmt  output format: csv, bin (see samplefmt.py) [csv]'
+    print '-i secs sampling interval, e.g. 0.05 for 20Hz [0.5]'
+    print '-F rows flush the output every <rows> samples [60, 1 to stdout]'
+    print '-s secs sync the output to disk every <secs> seconds [10]'
+    print '-o file saves output stats to <file>, - streams them to'
+    print '        stdout, not with -D [/dev/null]'
     print '-p file saves pid to <file> [/dev/null]'
 
 
 if __name__ == "__main__":
-    optlist, args = getopt.getopt(sys.argv[1:], 'Dho:p:')
+    optlist, args = getopt.getopt(sys.argv[1:], 'CDF:f:hi:o:p:s:')
     opts = dict(optlist)
 
     if '-h' in opts:
         usage()
         sys.exit(0)
 
+    if (opts.get('-f', 'csv') not in _WRITERS or
+            ('-D' in opts and opts.get('-o') == '-')):
+        usage()
+        sys.exit(1)
+
     logging.basicConfig(level=logging.DEBUG)
 
     try:
-        libvirtd_pid, vdsm_pid = find_pids()
+        libvirtd_pid, vdsm_pid = (None, None) if '-C' in opts else find_pids()
     except Exception as exc:
         logging.error('failed to find PIDs: %s', str(exc))
         sys.exit(2)
     else:
+        signal.signal(signal.SIGTERM, handler)
+        signal.signal(signal.SIGINT, handler)
+        signal.signal(signal.SIGUSR1, handler)
         if '-D' in opts:
-            signal.signal(signal.SIGTERM, handler)
-            signal.signal(signal.SIGINT, handler)
-            signal.signal(signal.SIGUSR1, handler)
             with daemon.DaemonContext():
                 _main(opts, libvirtd_pid, vdsm_pid)
         else:
-            logging.info('found pids: libvirt=%i vdsm=%i', libvirtd_pid, vdsm_pid)
+            if libvirtd_pid is not None:
+                logging.info('found pids: libvirt=%i vdsm=%i',
+                             libvirtd_pid, vdsm_pid)
             _main(opts, libvirtd_pid, vdsm_pid)
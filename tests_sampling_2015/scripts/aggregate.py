@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+"""
+Aggregates the replicas of every test configuration, so that two
+configurations can be compared by more than a look at the overlays of
+viewcpu.py.
+
+Files are grouped by configuration after their name, less the replica
+number: rh7_100vms_bulk_extproc.csv and rh7_100vms_bulk_extproc2.csv
+are replicas of rh7_100vms_bulk_extproc.csv. Samples of different
+formats come from different samplers, so they are not mixed:
+rh7_100vms_bulk_extproc_00.json is a replica of
+rh7_100vms_bulk_extproc.json.
+The replicas are loaded in parallel worker processes, and resampled on
+a common time grid from the start of every run. Then, for every metric
+and time step, the spread across the replicas is summarized: mean,
+median, percentile band and 95% confidence interval of the mean.
+"""
+
+import argparse
+import collections
+import logging
+import math
+import multiprocessing
+import os
+import re
+import sys
+import warnings
+
+import numpy
+
+# modules shared by all the tools, see common/
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                os.pardir, os.pardir, 'common'))
+import dataset
+
+
+# metric -> columns holding it, the first found wins (as in viewcpu.py)
+_METRICS = (('libvirt', ('libvirtd.cpu',)),
+            ('vdsm', ('vdsm_main.cpu', 'vdsm.cpu')),
+            ('host', ('host.cpu',)),
+            ('sampler', ('vdsm_sampler.cpu', 'vmon.cpu')),
+            ('mom', ('momd.cpu', 'python.cpu')))
+_REPLICA = re.compile(r'^(.*?)_?(\d+)?\.(csv|json|bin)$')
+# two sided 95% critical values of the Student t distribution,
+# by degrees of freedom; the normal one past the table
+_T95 = (12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262,
+        2.228, 2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101,
+        2.093, 2.086, 2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052,
+        2.048, 2.045, 2.042)
+_Z95 = 1.960
+
+
+def configuration(path):
+    """The configuration name of the replica `path', None if not one."""
+    name = os.path.basename(path)
+    match = _REPLICA.match(name)
+    if match is None or name.startswith('.'):
+        return None
+    return '%s.%s' % (match.group(1), match.group(3))
+
+
+def group(paths):
+    """
+    Returns {configuration: [replica paths]} out of `paths', files or
+    directories of them. A file given more than once, under any path,
+    is one replica only.
+    """
+    found = collections.defaultdict(set)
+    for path in paths:
+        if os.path.isdir(path):
+            names = [os.path.join(path, name)
+                     for name in os.listdir(path)
+                     if not name.startswith('.')]
+        else:
+            names = [path]
+        for name in names:
+            config = configuration(name)
+            if config is not None and os.path.isfile(name):
+                found[config].add(os.path.realpath(name))
+    return dict((config, sorted(names)) for config, names in found.items())
+
+
+def _host(data):
+    if 'host.cpu' in data:
+        return data['host.cpu']
+    # vdsmmon.py CSV: the host total comes last
+    hosts = sorted((column for column in data
+                    if column.startswith('host.cpu[')),
+                   key=lambda column: int(column[len('host.cpu['):-1]))
+    return data[hosts[-1]] if hosts else None
+
+
+def _metric(data, name, columns):
+    if name == 'host':
+        return _host(data)
+    for column in columns:
+        if column in data:
+            return data[column]
+    return None
+
+
+def _load(args):
+    """
+    Runs in the workers: returns (path, {metric: usage}), the usage
+    resampled every `step' seconds from the first sample.
+    """
+    path, step = args
+    data = dataset.load(path)
+    elapsed = data['timestamp'] - data['timestamp'][0]
+    grid = numpy.arange(0., elapsed[-1], step)
+    series = {}
+    for name, columns in _METRICS:
+        values = _metric(data, name, columns)
+        if values is not None and numpy.any(values == values):
+            series[name] = numpy.interp(grid, elapsed, values)
+    return path, series
+
+
+def _t95(count):
+    if count < 2:
+        return float('nan')
+    return _T95[count - 2] if count - 2 < len(_T95) else _Z95
+
+
+def summarize(replicas, percentile=10.):
+    """
+    Returns ({metric: {stat: per step array}}, {metric: per replica
+    means}) of `replicas', [{metric: usage}], over the time span all of
+    them cover. The stats are mean, median, low and high, the
+    `percentile' and 100 - `percentile' band, ci_low and ci_high.
+    """
+    metrics = [name for name, _ in _METRICS
+               if all(name in series for series in replicas)]
+    if not metrics:
+        return {}, {}
+    steps = min(len(series[metrics[0]]) for series in replicas)
+    summary = collections.OrderedDict()
+    means = {}
+    with warnings.catch_warnings():
+        # steps missing in every replica give NaN, not a warning
+        warnings.simplefilter('ignore', RuntimeWarning)
+        for name in metrics:
+            stack = numpy.vstack([series[name][:steps]
+                                  for series in replicas])
+            count = numpy.sum(stack == stack, axis=0)
+            mean = numpy.nanmean(stack, axis=0)
+            if len(replicas) > 1:
+                error = (numpy.nanstd(stack, axis=0, ddof=1) /
+                         numpy.sqrt(count) *
+                         numpy.array([_t95(n) for n in count]))
+            else:
+                error = numpy.full(steps, numpy.nan)
+            low, high = numpy.nanpercentile(
+                stack, [percentile, 100. - percentile], axis=0)
+            summary[name] = collections.OrderedDict((
+                ('mean', mean),
+                ('median', numpy.nanmedian(stack, axis=0)),
+                ('low', low),
+                ('high', high),
+                ('ci_low', mean - error),
+                ('ci_high', mean + error)))
+            means[name] = numpy.nanmean(stack, axis=1)
+    return summary, means
+
+
+def confidence(values):
+    """Returns (mean, half width of its 95% confidence interval)."""
+    values = values[values == values]
+    if len(values) < 2:
+        return float(numpy.mean(values)), float('nan')
+    error = numpy.std(values, ddof=1) / math.sqrt(len(values))
+    return float(numpy.mean(values)), _t95(len(values)) * error
+
+
+def save(summary, step, path):
+    """Writes the summary series as CSV, with a vdsmmon.py-like header."""
+    columns = ['time']
+    values = []
+    for name, stats in summary.items():
+        for stat, seq in stats.items():
+            columns.append('%s.%s' % (name, stat))
+            values.append(seq)
+    steps = len(values[0]) if values else 0
+    with open(path, 'wt') as out:
+        out.write('# columns=%s\n' % ','.join(columns))
+        for idx in range(steps):
+            out.write('%.1f,%s\n' % (idx * step, ','.join(
+                '%.3f' % seq[idx] for seq in values)))
+
+
+def show(results, out=sys.stdout):
+    for config, count, span, means in results:
+        out.write('%s: %i replicas, %.0fs\n' % (config, count, span))
+        for name, _ in _METRICS:
+            if name not in means:
+                continue
+            mean, error = confidence(means[name])
+            out.write('  %-8s mean %6.2f%% +/- %5.2f%% (95%% CI), '
+                      'median %6.2f%%, replicas %6.2f%% - %6.2f%%\n' % (
+                          name, mean, error,
+                          numpy.median(means[name]),
+                          numpy.min(means[name]), numpy.max(means[name])))
+
+
+def plot(summaries, step, out_file=None):
+    """
+    Plots the mean of every configuration over its percentile band,
+    one subplot per metric.
+    """
+    import matplotlib.pyplot as plt
+
+    metrics = [name for name, _ in _METRICS
+               if any(name in summary for _, summary in summaries)]
+    plt.figure(1)
+    for idx, name in enumerate(metrics):
+        plt.subplot(len(metrics), 1, idx + 1)
+        for config, summary in summaries:
+            if name not in summary:
+                continue
+            stats = summary[name]
+            t = numpy.arange(len(stats['mean'])) * step
+            line, = plt.plot(t, stats['mean'], label=config)
+            plt.fill_between(t, stats['low'], stats['high'],
+                             color=line.get_color(), alpha=0.2)
+        plt.ylabel('%s cpu %%' % name)
+        plt.grid(True)
+    plt.xlabel('time in secs')
+    plt.legend(loc='upper right')
+    if out_file:
+        fig = plt.gcf()
+        fig.set_size_inches(18.5, 10.5)
+        fig.savefig(out_file)
+    else:
+        plt.show()
+
+
+def _main():
+    parser = argparse.ArgumentParser(
+        description='aggregate the replicas of VDSM benchmark runs')
+    parser.add_argument('sources', metavar='path', type=str, nargs='+',
+                        help='datasets, or directories of them')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='worker processes [one per CPU]')
+    parser.add_argument('-s', '--step', type=float, default=0.5,
+                        help='seconds between the summary steps [0.5]')
+    parser.add_argument('-p', '--percentile', type=float, default=10.,
+                        help='the band spans from this percentile to '
+                             '100 minus it [10]')
+    parser.add_argument('-d', '--dest', type=str, default=None,
+                        help='write <configuration>.summary.csv here')
+    parser.add_argument('--plot', action='store_true', default=False,
+                        help='plot the summaries')
+    parser.add_argument('--out', dest='out_file', type=str,
+                        help='save the plot to file')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    groups = group(args.sources)
+    if not groups:
+        logging.error('no datasets found')
+        sys.exit(1)
+
+    paths = [path for config in sorted(groups) for path in groups[config]]
+    pool = multiprocessing.Pool(args.jobs)
+    try:
+        loaded = dict(pool.map(_load, [(path, args.step)
+                                       for path in paths]))
+    finally:
+        pool.close()
+        pool.join()
+
+    results = []
+    summaries = []
+    for config in sorted(groups):
+        replicas = [loaded[path] for path in groups[config]]
+        summary, means = summarize(replicas, args.percentile)
+        if not summary:
+            logging.warning('%s: no metric found in all replicas', config)
+            continue
+        steps = len(next(iter(summary.values()))['mean'])
+        results.append((config, len(replicas), steps * args.step, means))
+        summaries.append((config, summary))
+        if args.dest:
+            save(summary, args.step,
+                 os.path.join(args.dest, '%s.summary.csv' % config))
+
+    show(results)
+    if args.plot or args.out_file:
+        plot(summaries, args.step, args.out_file)
+
+
+if __name__ == '__main__':
+    _main()
@@ -6,10 +6,19 @@ import os
 import os.path
 import json
 import signal
-import subprocess
 import sys
 import time
 
+# modules shared by all the tools, see common/
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                os.pardir, os.pardir, 'common'))
+import procfs
+import recorder
+import samplefmt
+from clock import monotonic
+from discovery import DAEMONS, Discovery, GUEST_PREFIX, identify, scan
+from ticker import Ticker
+
 try:
     import psutil
 except ImportError:
@@ -29,6 +38,9 @@ except ImportError:
     sys.exit(2)
 
 
+_SELF = 'capture'
+
+
 class StopSampling(Exception):
     """Stop sampling right now"""
 
@@ -38,36 +50,6 @@ def handler(signum, frame):
     raise StopSampling
 
 
-def mangle_pid(out):
-    try:
-        return list(sorted(int(token) for token in out.split()))
-    except:
-        return 0
-
-
-def find_pids():
-    pids = {
-        'libvirtd': mangle_pid(
-            subprocess.check_output(
-                ['/usr/sbin/pidof', 'libvirtd'])),
-        'vdsm': mangle_pid(
-            subprocess.check_output(
-                ['/usr/bin/pgrep', '-u', 'vdsm', 'vdsm']))}
-    try:
-        pids['vmon'] = mangle_pid(
-            subprocess.check_output(
-                ['/usr/sbin/pidof', 'vmon']))
-    except:
-        pass  # nevermind
-    try:
-        pids['momd'] = mangle_pid(
-            subprocess.check_output(
-                ['/usr/bin/pgrep', '-f', 'momd']))
-    except:
-        pass  # nevermind
-    return pids
-
-
 def write_pid_file(pidfile):
     try:
         with open(pidfile, 'wt') as out:
@@ -76,78 +58,311 @@ def write_pid_file(pidfile):
         logging.error('savepid(%s) failed: %s', pidfile, str(exc))
 
 
-def _get_name(proc):
-    name = proc.name()
-    if name == 'vdsm':
-        if proc.ppid() == 1:
-            return name + '_main'
-        else:
-            return name + '_sampler'
-#    elif name == 'vmon':
-#        return 'vdsm_sampler'
-    return name
-
-
-def sampler(procs, out, delay=0.5):
-    # see psutil docs. Discard the first one
-    for proc in procs:
+class PsutilProbe(object):
+    """
+    Samples the attached processes through psutil. Processes which
+    vanish are left out of the records and reported in `lost', until
+    they are detached.
+    """
+    def __init__(self, top_threads=0, metrics=(), top_guests=0):
+        if top_threads or metrics or top_guests:
+            logging.warning('per-thread, extra metrics and VM sampling '
+                            'need the procfs backend')
+        self._procs = {}
+        self.lost = []
+        # see psutil docs. Discard the first one
+        psutil.cpu_percent()
+
+    def attach(self, name, pid):
+        if name.startswith(GUEST_PREFIX):
+            return  # procfs only
+        proc = psutil.Process(pid)
         proc.cpu_percent()
+        self._procs[name] = proc
+
+    def detach(self, name):
+        self._procs.pop(name, None)
+
+    def sample(self):
+        record = {
+            'timestamp': time.time(),
+            'host': {
+                'cpu': psutil.cpu_percent()}}
+        self.lost = []
+        for name, proc in self._procs.items():
+            try:
+                record[name] = {
+                    'cpu': proc.cpu_percent(),
+                    'memory': proc.memory_info(),
+                    'threads': proc.num_threads()}
+            except psutil.NoSuchProcess:
+                record.pop(name, None)
+                self.lost.append(name)
+        return record
+
+
+class ProcfsProbe(object):
+    """
+    Same record as PsutilProbe, read straight from /proc: a few
+    read()s per tick instead of several psutil calls per process.
+    With `top_threads', the records of the vdsm processes also list
+    their busiest threads; `metrics' selects the optional metrics,
+    see procfs.METRICS and procfs.HOST_METRICS.
+    The qemu processes of the VMs, if attached, are summarized in the
+    'qemu' record, listing the `top_guests' using most CPU.
+    """
+    def __init__(self, top_threads=0, metrics=(), top_guests=0):
+        self._host = procfs.Host(metrics)
+        self._procs = {}
+        self._guests = {}
+        self._top_guests = top_guests
+        self._metrics = metrics
+        self._top = top_threads
+        self._threads = {}
+        self.lost = []
+
+    def attach(self, name, pid):
+        now = time.time()
+        if name.startswith(GUEST_PREFIX):
+            # the cheapest sample: there can be hundreds of them
+            self._guests[name] = procfs.Process(pid, now)
+            return
+        self._procs[name] = procfs.Process(pid, now, self._metrics)
+        if self._top and name.startswith('vdsm'):
+            self._threads[name] = procfs.Threads(pid, now)
+
+    def detach(self, name):
+        for tracked in (self._procs, self._threads, self._guests):
+            if name in tracked:
+                tracked.pop(name).close()
+
+    def sample(self):
+        now = time.time()
+        record = {
+            'timestamp': now,
+            'host': self._host.sample()}
+        self.lost = []
+        for name, proc in self._procs.items():
+            try:
+                record[name] = proc.sample(now)
+                if name in self._threads:
+                    record[name]['top_threads'] = self._threads[name].sample(
+                        now, self._top)
+            except (IOError, OSError):
+                record.pop(name, None)
+                self.lost.append(name)
+        if self._guests:
+            record['qemu'] = self._sample_guests(now)
+        return record
+
+    def _sample_guests(self, now):
+        """
+        Returns the totals of all the guests, and [VM name, cpu, rss]
+        of the busiest ones.
+        """
+        cpu, rss, vms, threads = 0., 0, 0, 0
+        usage = []
+        for name, proc in self._guests.items():
+            try:
+                sample = proc.sample(now)
+            except (IOError, OSError):
+                self.lost.append(name)
+                continue
+            cpu += sample['cpu']
+            rss += sample['memory'][0]
+            vms += sample['memory'][1]
+            threads += sample['threads']
+            usage.append((sample['cpu'], sample['memory'][0], name))
+        usage.sort(reverse=True)
+        return {
+            'count': len(usage),
+            'cpu': round(cpu, 1),
+            'memory': [rss, vms],
+            'threads': threads,
+            'top': [[name[len(GUEST_PREFIX):], vm_cpu, vm_rss]
+                    for vm_cpu, vm_rss, name in usage[:self._top_guests]]}
+
+
+_PROBES = {
+    'procfs': ProcfsProbe,
+    'psutil': PsutilProbe,
+}
+
+
+class JsonWriter(object):
+    def __init__(self, out):
+        self._out = out
+
+    def write_record(self, record):
+        self._out.write('%s\n' % json.dumps(record))
+
+    def flush(self):
+        self._out.flush()
+
+    def close(self):
+        self._out.flush()
+
+
+# the summary of the guests, see ProcfsProbe
+_GUEST_COLUMNS = ('qemu.count', 'qemu.cpu', 'qemu.memory[0]',
+                  'qemu.memory[1]', 'qemu.threads')
+
+
+def _columns(record):
+    """
+    All the columns a sampling run may need, out of its first record:
+    samplefmt files can't grow columns, and daemons may be found
+    later. Every daemon gets the columns of capture itself.
+    """
+    columns = set(c for c, _ in samplefmt.flatten(record))
+    prefix = _SELF + '.'
+    fields = [c[len(prefix):] for c in columns
+              if c.startswith(prefix) and c != prefix + 'latency']
+    for name in DAEMONS:
+        columns.update('%s.%s' % (name, field) for field in fields)
+    columns.update(_GUEST_COLUMNS)
+    return sorted(columns)
+
+
+class BinWriter(object):
+    """
+    Writes samplefmt files; the columns are declared out of the first
+    record, see _columns.
+    """
+    def __init__(self, out):
+        self._out = out
+        self._writer = None
+
+    def write_record(self, record):
+        if self._writer is None:
+            self._start(record)
+        self._writer.write_record(record)
+
+    def flush(self):
+        self._out.flush()
+
+    def close(self):
+        """Writes the trailer, after the header if nothing was sampled."""
+        if self._writer is None:
+            self._start({'timestamp': 0.})
+        self._writer.close()
+
+    def _start(self, record):
+        self._writer = samplefmt.Writer(self._out, _columns(record),
+                                        {'sampler': 'capture.py'})
+
+
+_WRITERS = {
+    'json': JsonWriter,
+    'bin': BinWriter,
+}
+
+
+def _apply(probe, events):
+    for event in events:
+        logging.info('%s: %s pid=%i', event['event'], event['name'],
+                     event['pid'])
+        if event['event'] == 'detach':
+            probe.detach(event['name'])
+            continue
+        try:
+            probe.attach(event['name'], event['pid'])
+        except (IOError, OSError, psutil.NoSuchProcess):
+            # gone already: the next scan reports it
+            event['event'] = 'lost'
+
 
-    SYNC = 60
+def sampler(probe, discovery, out, delay=0.5, sync=60):
+    """
+    Without `discovery', samples only what is attached to `probe'.
+    `out' is flushed every `sync' samples.
+    """
     step = 0
+    latency = 0.
+    ticker = Ticker(delay)
 
     while True:
         try:
-            record = {
-                'timestamp': time.time(),
-                'host': {
-                    'cpu': psutil.cpu_percent()}}
-            for proc in procs:
-                record[_get_name(proc)] = {
-                    'cpu': proc.cpu_percent(),
-                    'memory': proc.memory_info(),
-                    'threads': proc.num_threads()}
-
-            out.write('%s\n' % json.dumps(record))
+            missed = ticker.wait()
+            begin = monotonic()
+            events = []
+            if discovery is not None:
+                events = discovery.poll(begin, probe.lost)
+                _apply(probe, events)
+            record = probe.sample()
+            # ticks skipped because the previous sample took too long
+            record['missed'] = missed
+            if _SELF in record:
+                # seconds spent sampling and writing the previous tick
+                record[_SELF]['latency'] = round(latency, 6)
+            if events:
+                # process topology changes, in the order they happened
+                record['events'] = events
+            out.write_record(record)
 
-            if step >= SYNC:
+            step += 1
+            if step >= sync:
                 step = 0
                 out.flush()
-            step += 1
-            time.sleep(delay)
+            latency = monotonic() - begin
         except KeyboardInterrupt:
             break
         except StopSampling:
             break
 
 
-def _main(opts, pids):
-    vdsm = psutil.Process(pids['vdsm'][0])
-    procs = [psutil.Process(pids['libvirtd'][0]),
-             vdsm]
+def _sample(probe, discovery, out, delay, sync):
+    try:
+        sampler(probe, discovery, out, delay, sync)
+    finally:
+        # a clean stop: the trailer tells the file is complete
+        out.close()
+
 
-    if len(pids['vdsm']) > 1:
-        vdsm_sampler = psutil.Process(pids['vdsm'][1])
-        if vdsm_sampler.ppid() == vdsm.pid:
-            procs.append(vdsm_sampler)
-    elif 'vmon' in pids:
-        procs.append(psutil.Process(pids['vmon'][0]))
+def _metrics(spec):
+    if spec == 'all':
+        return procfs.METRICS + procfs.HOST_METRICS
+    return tuple(name for name in spec.split(',') if name)
 
-    if 'momd' in pids:
-        procs.append(psutil.Process(pids['momd'][0]))
 
+def _main(opts):
     if '-p' in opts:
         write_pid_file(opts['-p'])
 
-    for proc in procs:
-        logging.info('tracking: %s pid=%i ppid=%i',
-                     _get_name(proc), proc.pid, proc.ppid())
-
+    if '-C' in opts:
+        discovery = None
+        busy = sorted(identify(scan()))
+        if busy:
+            logging.warning('calibrating, but the host is not idle: %s',
+                            ', '.join(busy))
+    else:
+        discovery = Discovery(float(opts.get('-r', 5.)), '-q' in opts)
     start = time.time()
     logging.info('begin sampling at %f', start)
 
-    with open(opts.get('-o', '/dev/null'), 'wt') as out:
-        sampler(procs, out)
+    probe = _PROBES[opts.get('-b', 'procfs')](int(opts.get('-t', 0)),
+                                              _metrics(opts.get('-m', '')),
+                                              int(opts.get('-q', 0)))
+    # the sampler accounts for itself, like for the daemons
+    probe.attach(_SELF, os.getpid())
+    delay = float(opts.get('-i', 0.5))
+
+    fmt = opts.get('-f', 'json')
+
+    if '-w' in opts:
+        rec = recorder.Recorder(opts['-o'], delay, float(opts['-w']),
+                                float(opts.get('-a', 60.)),
+                                recorder.parse_triggers(opts.get('-T', '')))
+        signal.signal(signal.SIGUSR2,
+                      lambda signum, frame: rec.request('signal'))
+        _sample(probe, discovery, rec, delay, 60)
+    elif opts.get('-o') == '-':
+        # streaming, e.g. over ssh: every sample goes out at once
+        _sample(probe, discovery, _WRITERS[fmt](sys.stdout), delay, 1)
+    else:
+        with open(opts.get('-o', '/dev/null'),
+                  'wb' if fmt == 'bin' else 'wt') as out:
+            _sample(probe, discovery, _WRITERS[fmt](out), delay, 60)
 
     stop = time.time()
     logging.info('end sampling at %f' % stop)
@@ -156,37 +371,66 @@ def _main(opts, pids):
 
 def usage():
     print '-h      this message'
+    print '-a secs flight recorder: keep sampling <secs> after a trigger [60]'
+    print '-C      calibrate: sample only the host and capture itself,'
+    print '        to measure the baseline on an idle host'
     print '-D      became daemon'
-    print '-o file saves output stats to <file> [/dev/null]'
+    print '-b name sampling backend: procfs, psutil [procfs]'
+    print '-f fmt  output format: json, bin (see samplefmt.py) [json]'
+    print '-i secs sampling interval, e.g. 0.05 for 20Hz [0.5]'
+    print '-m list extra metrics, comma separated, procfs only:'
+    print '        %s, or all [none]' % ', '.join(
+        procfs.METRICS + procfs.HOST_METRICS)
+    print '-o file saves output stats to <file>, - streams them to'
+    print '        stdout, not with -D [/dev/null]'
     print '-p file saves pid to <file> [/dev/null]'
+    print '-q num  sample the qemu processes of the VMs, reporting totals'
+    print '        and the <num> busiest VMs, procfs only'
+    print '-r secs rescan for started/stopped daemons every <secs> [5]'
+    print '-T spec flight recorder: triggers for vdsm_main, see recorder.py;'
+    print '        SIGUSR2 always triggers a dump'
+    print '-w secs flight recorder: keep the last <secs> of samples in'
+    print '        memory, dump them to <file>.<time>.<n>.<trigger>.json,'
+    print '        json only'
+    print '-t num  report the <num> busiest vdsm threads, procfs only [0]'
 
 
 if __name__ == "__main__":
-    optlist, args = getopt.getopt(sys.argv[1:], 'Dho:p:')
+    optlist, args = getopt.getopt(sys.argv[1:], 'a:b:CDf:hi:m:o:p:q:r:T:t:w:')
     opts = dict(optlist)
 
     if '-h' in opts:
         usage()
         sys.exit(0)
 
+    if (opts.get('-b', 'procfs') not in _PROBES or
+            opts.get('-f', 'json') not in _WRITERS or
+            not set(_metrics(opts.get('-m', ''))).issubset(
+                procfs.METRICS + procfs.HOST_METRICS)):
+        usage()
+        sys.exit(1)
+
+    if '-D' in opts and opts.get('-o') == '-':
+        usage()
+        sys.exit(1)
+
+    if '-w' in opts:
+        try:
+            recorder.parse_triggers(opts.get('-T', ''))
+        except ValueError as exc:
+            sys.stderr.write('%s\n' % exc)
+            sys.exit(1)
+        if '-o' not in opts or opts.get('-f', 'json') != 'json':
+            usage()
+            sys.exit(1)
+
     logging.basicConfig(level=logging.DEBUG)
 
-    try:
-        pids = find_pids()
-    except Exception as exc:
-        logging.error('failed to find PIDs: %s', str(exc))
-        sys.exit(2)
+    signal.signal(signal.SIGTERM, handler)
+    signal.signal(signal.SIGINT, handler)
+    signal.signal(signal.SIGUSR1, handler)
+    if '-D' in opts:
+        with daemon.DaemonContext():
+            _main(opts)
     else:
-        if '-D' in opts:
-            signal.signal(signal.SIGTERM, handler)
-            signal.signal(signal.SIGINT, handler)
-            signal.signal(signal.SIGUSR1, handler)
-            with daemon.DaemonContext():
-                _main(opts, pids)
-        else:
-            logging.info('found pids:')
-            for n, ps in pids.iteritems():
-                logging.info(' %s: %s',
-                             n,
-                             ','.join('%i' % p for p in  ps))
-            _main(opts, pids)
+        _main(opts)
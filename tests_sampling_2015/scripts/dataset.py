@@ -0,0 +1,154 @@
+"""
+Loads sample files as numpy columns, one array per process and metric,
+named like the samplefmt.py columns: 'vdsm_main.cpu', 'host.cpu',
+'libvirtd.memory[0]'.
+
+Parsing thousands of JSON lines takes far longer than plotting them,
+so the columns are cached next to the source, in '.<name>.cache', a
+samplefmt.py file which is memory mapped on the next load. The cache
+is keyed by the path, modification time and size of the source, and
+is rebuilt whenever any of them changes. It stores the floats as
+doubles, not as the floats of the sample files, so the values load
+unchanged.
+"""
+
+import json
+import logging
+import os
+
+import numpy
+
+import samplefmt
+
+
+_SUFFIX = '.cache'
+# bumped when the cache layout changes, to rebuild the older caches
+_VERSION = 3
+
+
+def cache_path(source):
+    head, tail = os.path.split(source)
+    return os.path.join(head, '.' + tail + _SUFFIX)
+
+
+def _key(source):
+    info = os.stat(source)
+    return {'source': os.path.abspath(source),
+            'mtime': info.st_mtime,
+            'size': info.st_size,
+            'version': _VERSION}
+
+
+def _json_rows(source):
+    """
+    Returns (columns, rows). Processes may come and go while sampling,
+    so the columns are the ones of all the records.
+    """
+    records = []
+    with open(source, 'rt') as src:
+        for line in src:
+            try:
+                records.append(dict(samplefmt.flatten(json.loads(line))))
+            except ValueError:
+                continue  # torn last line, left by a killed sampler
+    columns = set()
+    for record in records:
+        columns.update(record)
+    columns = sorted(columns)
+    return columns, [[record.get(column) for column in columns]
+                     for record in records]
+
+
+def _csv_rows(source):
+    header = None
+    rows = []
+    with open(source, 'rt') as src:
+        for line in src:
+            if line.startswith(samplefmt.CSV_HEADER):
+                header = line
+            elif line.startswith('#') or not line.strip():
+                continue
+            else:
+                row = line.split(',')
+                if rows and len(row) != len(rows[0]):
+                    continue  # torn last line
+                rows.append(row)
+    if not rows:
+        return samplefmt.csv_columns(0, header), []
+    return (samplefmt.csv_columns(len(rows[0]), header),
+            numpy.array(rows, dtype=numpy.float64))
+
+
+def _parse(source):
+    if source.endswith('csv'):
+        return _csv_rows(source)
+    elif source.endswith('json'):
+        return _json_rows(source)
+    raise RuntimeError('unsupported data source: %s' % source)
+
+
+def _columns(reader):
+    """Returns {column: array} out of the rows mapped by `reader'."""
+    data = reader.load()
+    columns = {}
+    for column, kind in zip(reader.columns, reader.types):
+        values = data[str(column)]
+        if kind in samplefmt._INTEGERS:
+            missing = values == samplefmt._MISSING[kind]
+            values = values.astype(numpy.float64)
+            values[missing] = numpy.nan
+        columns[column] = values
+    return columns
+
+
+def _cached(source, key):
+    path = cache_path(source)
+    try:
+        reader = samplefmt.Reader(path)
+    except (IOError, OSError, ValueError):
+        return None
+    if reader.meta != key or not reader.complete:
+        return None
+    return reader
+
+
+def _cache_type(column):
+    kind = samplefmt.column_type(column)
+    return kind if kind in samplefmt._INTEGERS else 'd'
+
+
+def _store(source, key):
+    columns, rows = _parse(source)
+    path = cache_path(source)
+    tmp = path + '.tmp'
+    try:
+        with open(tmp, 'wb') as out:
+            writer = samplefmt.Writer(out, columns, key,
+                                      [_cache_type(c) for c in columns])
+            for row in rows:
+                writer.write(row)
+            writer.close()
+        os.rename(tmp, path)
+    except (IOError, OSError) as exc:
+        logging.warning('cannot cache %s: %s', source, exc)
+        return None
+    return samplefmt.Reader(path)
+
+
+def load(source):
+    """
+    Returns {column: numpy array} of the samples in `source': JSON
+    from capture.py, CSV from vdsmmon.py, or a samplefmt.py file.
+    Missing values are NaN.
+    """
+    if source.endswith('bin'):
+        return _columns(samplefmt.Reader(source))
+    key = _key(source)
+    reader = _cached(source, key) or _store(source, key)
+    if reader is not None:
+        return _columns(reader)
+    # no cache, e.g. on a read only directory
+    columns, rows = _parse(source)
+    rows = numpy.array(rows, dtype=numpy.float64)
+    return dict((column, rows[:, idx] if len(rows) else rows)
+                for idx, column in enumerate(columns))
@@ -0,0 +1,190 @@
+"""
+In-process discovery of the daemons to sample.
+
+Scans /proc instead of forking pidof/pgrep, so it is cheap enough to
+be repeated while sampling: daemons which come up late, restart or
+fork a child are picked up at the next scan.
+Processes are told apart by pid and start time, so a reused pid is
+not mistaken for the process which had it before.
+"""
+
+import logging
+import os
+import pwd
+
+
+# names of the daemons identify() may find
+DAEMONS = ('libvirtd', 'vdsm_main', 'vdsm_sampler', 'vmon', 'momd')
+# guests are tracked as '<prefix><VM name>'
+GUEST_PREFIX = 'qemu/'
+
+class ProcInfo(object):
+    """
+    Fields of /proc/<pid>/stat, counted after the command name:
+    0 state, 1 ppid, ..., 19 starttime.
+    """
+    def __init__(self, pid):
+        self.pid = pid
+        with open('/proc/%i/stat' % pid, 'rb') as src:
+            data = src.read()
+        end = data.rindex(b')')
+        self.comm = data[data.index(b'(') + 1:end].decode('utf-8', 'replace')
+        fields = data[end + 2:].split()
+        self.state = fields[0].decode('ascii')
+        self.ppid = int(fields[1])
+        self.start = int(fields[19])
+        self.uid = os.stat('/proc/%i' % pid).st_uid
+        self._cmdline = None
+
+    @property
+    def cmdline(self):
+        if self._cmdline is None:
+            with open('/proc/%i/cmdline' % self.pid, 'rb') as src:
+                self._cmdline = src.read().decode(
+                    'utf-8', 'replace').split('\0')
+        return self._cmdline
+
+
+def scan():
+    """Yields a ProcInfo for every process running, zombies excluded."""
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            proc = ProcInfo(int(entry))
+        except (IOError, OSError):
+            continue  # just exited
+        if proc.state != 'Z':
+            yield proc
+
+
+def _is_momd(proc):
+    if proc.comm == 'momd':
+        return True
+    if not proc.comm.startswith('python'):
+        return False
+    try:
+        return any(arg.endswith('momd') for arg in proc.cmdline)
+    except (IOError, OSError):
+        return False
+
+
+def identify(procs, vdsm_uid=None):
+    """
+    Returns {name: ProcInfo} for the daemons found among `procs':
+    libvirtd, vdsm_main, vdsm_sampler (a vdsm child of vdsm_main),
+    vmon and momd. vdsm processes must belong to `vdsm_uid', if given.
+    """
+    found = {}
+    vdsm = []
+    for proc in sorted(procs, key=lambda proc: proc.pid):
+        if proc.comm == 'libvirtd':
+            found.setdefault('libvirtd', proc)
+        elif proc.comm == 'vmon':
+            found.setdefault('vmon', proc)
+        elif proc.comm == 'vdsm':
+            if vdsm_uid is None or proc.uid == vdsm_uid:
+                vdsm.append(proc)
+        elif _is_momd(proc):
+            found.setdefault('momd', proc)
+    pids = set(proc.pid for proc in vdsm)
+    for proc in vdsm:
+        if proc.ppid not in pids:
+            found.setdefault('vdsm_main', proc)
+    main = found.get('vdsm_main')
+    for proc in vdsm:
+        if main is not None and proc.ppid == main.pid:
+            found.setdefault('vdsm_sampler', proc)
+    return found
+
+
+def _is_qemu(proc):
+    return proc.comm.startswith(('qemu-kvm', 'qemu-system'))
+
+
+def guest_name(cmdline):
+    """
+    The VM name from a qemu command line: '-name guest=NAME,...'
+    with recent libvirt, '-name NAME' with older ones.
+    """
+    try:
+        value = cmdline[cmdline.index('-name') + 1]
+    except (ValueError, IndexError):
+        return None
+    for option in value.split(','):
+        if option.startswith('guest='):
+            return option[len('guest='):]
+    return value.split(',')[0]
+
+
+def guests(procs):
+    """Returns {GUEST_PREFIX + VM name: ProcInfo} for the qemu processes."""
+    found = {}
+    for proc in procs:
+        if not _is_qemu(proc):
+            continue
+        try:
+            name = guest_name(proc.cmdline)
+        except (IOError, OSError):
+            continue  # just exited
+        if name is not None:
+            found[GUEST_PREFIX + name] = proc
+    return found
+
+
+def _vdsm_uid():
+    try:
+        return pwd.getpwnam('vdsm').pw_uid
+    except KeyError:
+        logging.warning('no vdsm user, tracking vdsm of any user')
+        return None
+
+
+class Discovery(object):
+    """
+    Keeps track of the daemons, and of the qemu processes of the VMs
+    if `guests', rescanning /proc every `interval' seconds or as soon
+    as some of them are reported lost.
+    """
+    def __init__(self, interval=5., guests=False):
+        self.interval = interval
+        self._guests = guests
+        self._uid = _vdsm_uid()
+        self._found = {}  # name -> (pid, start time)
+        self._last = None
+
+    @property
+    def found(self):
+        """Returns {name: pid} of the daemons tracked now."""
+        return dict((name, pid) for name, (pid, _) in self._found.items())
+
+    def poll(self, now, lost=()):
+        """
+        Rescans if it is time to, or if any name is `lost'.
+        Returns the changes since the previous scan, as a list of
+        {'event': 'attach'|'detach', 'name': name, 'pid': pid},
+        detaches first.
+        """
+        if (not lost and self._last is not None and
+                now - self._last < self.interval):
+            return []
+        self._last = now
+        procs = list(scan())
+        found = identify(procs, self._uid)
+        if self._guests:
+            found.update(guests(procs))
+        found = dict((name, (proc.pid, proc.start))
+                     for name, proc in found.items())
+        events = []
+        for name in sorted(self._found):
+            if found.get(name) != self._found[name]:
+                events.append({'event': 'detach',
+                               'name': name,
+                               'pid': self._found[name][0]})
+        for name in sorted(found):
+            if self._found.get(name) != found[name]:
+                events.append({'event': 'attach',
+                               'name': name,
+                               'pid': found[name][0]})
+        self._found = found
+        return events
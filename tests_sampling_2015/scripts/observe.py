@@ -3,10 +3,15 @@
 import argparse
 from collections import defaultdict
 import logging
+import os.path
 import subprocess
 import sys
 import time
 
+# modules shared by all the tools, see common/
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                os.pardir, os.pardir, 'common'))
+import collect
 from ovirtsdk.xml import params
 from ovirtsdk.api import API
 
@@ -104,43 +109,88 @@ def idle(secs_, chunk=10):
         elapsed += chunk
 
 
-def monitor(host, action, args, workdir='$HOME', path=''):
-    subprocess.call(['ssh', host,
-                      'PATH=$PATH:'+ path, 'capture.py', '-D',
-                      '-o', workdir + '/samples.json',
-                      '-p', workdir +  '/mon.pid'])
-
-    action(*args)
-
-    subprocess.call(['ssh', host,
-                     'kill', '-USR1',
-                     '$(', 'cat', workdir + '/mon.pid', ')'])
-    data = subprocess.check_output(['ssh', host,
-                                    'cat', 'samples.json'])
-    subprocess.call(['ssh', host,
-                     'rm', 'samples.json', 'mon.pid'])
-    return data
-
-
-def bench(host, name, first, last, api, outfile, delay=None):
+# seconds a sampler may take to write its first line
+_START_TIMEOUT = 30.
+
+
+def monitor(hosts, action, args, outfile, workdir='$HOME', path=''):
+    """
+    Runs `action' while sampling all the `hosts' at once; the samples
+    are streamed over ssh into `outfile' as they are taken. With more
+    than one host, every host gets its own '<outfile>.<host>' file, and
+    `outfile' gets their samples merged on the local clock, see
+    collect.merge. The action begins once all the samplers are ready.
+    Returns the samples count.
+    """
+    offsets = collect.clock_offsets(hosts)
+    if len(hosts) == 1:
+        outfiles = {hosts[0]: outfile}
+    else:
+        outfiles = dict((host, '%s.%s' % (outfile, host)) for host in hosts)
+    # hosts may share the home directory: one pid file per host and run
+    pidfiles = dict((host, '%s/mon.%s.%i.pid' % (workdir, host, os.getpid()))
+                    for host in hosts)
+    samplers, collectors = [], []
+    try:
+        for host in hosts:
+            sampler = subprocess.Popen(['ssh', host,
+                                        'PATH=$PATH:' + path, 'capture.py',
+                                        '-o', '-',
+                                        '-p', pidfiles[host]],
+                                       stdout=subprocess.PIPE)
+            samplers.append(sampler)
+            collector = collect.Collector(host, sampler.stdout,
+                                          open(outfiles[host], 'wb'),
+                                          collect.JsonParser())
+            collectors.append(collector)
+            collector.start()
+        for collector in collectors:
+            # the pid file is written before the first line: the
+            # sampler can be stopped from then on
+            if not collector.wait_started(_START_TIMEOUT):
+                raise RuntimeError('%s: the sampler did not start' %
+                                   collector.host)
+        action(*args)
+    finally:
+        for collector in collectors:
+            collector.stop()
+        for host in hosts[:len(samplers)]:
+            subprocess.call(['ssh', host,
+                             'kill', '-USR1',
+                             '$(', 'cat', pidfiles[host], ')'])
+        for sampler in samplers:
+            sampler.wait()
+        for collector in collectors:
+            collector.join()
+            collector.out.close()
+        for host in hosts[:len(samplers)]:
+            subprocess.call(['ssh', host,
+                             'rm', pidfiles[host]])
+    if len(hosts) > 1:
+        collect.merge([(host, outfiles[host], offsets[host][0])
+                       for host in hosts], outfile)
+    return sum(collector.rows for collector in collectors)
+
+
+def bench(hosts, name, first, last, api, outfile, delay=None):
     vms = [ VMHandle(api, i, name) for i in range(first, last) ]
     started_vms = start(vms)
 #    wait(started_vms)
 
     begin = time.time()
-    data = monitor(host, idle, (delay,))
+    rows = monitor(hosts, idle, (delay,), outfile)
     end = time.time()
 
     stop(started_vms)
-    return data
+    return rows
 
 
 if __name__ == '__main__':
     if len(sys.argv) != 7:
-        print 'usage: host vmname start stop mins outfile'
+        print 'usage: host[,host...] vmname start stop mins outfile'
         sys.exit(1)
 
-    host = sys.argv[1]
+    hosts = sys.argv[1].split(',')
     vmname = sys.argv[2]
     first = int(sys.argv[3])
     last = int(sys.argv[4])
@@ -153,7 +203,5 @@ if __name__ == '__main__':
               password='PASS',
               insecure=True)
 
-    data = bench(host, vmname + '_C%03i', first, last, api, outfile, mins * 60.)
-
-    with open(outfile, 'wb') as out:
-        out.write(data)
+    rows = bench(hosts, vmname + '_C%03i', first, last, api, outfile, mins * 60.)
+    logging.info('%i samples saved in %s', rows, outfile)
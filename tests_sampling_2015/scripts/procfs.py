@@ -0,0 +1,259 @@
+"""
+Direct /proc reader for the samplers.
+
+The /proc files of the tracked processes are opened once and reread
+at every tick into preallocated buffers, so a sample costs one
+read() per file, with no open() and no psutil call rounds.
+CPU usage is computed from the tick counters, like psutil does.
+"""
+
+import errno
+import io
+import logging
+import os
+
+
+_CLK_TCK = float(os.sysconf('SC_CLK_TCK'))
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+_BUF_SIZE = 4096
+
+# optional metrics, of the processes and of the host
+METRICS = ('ctx', 'faults', 'io', 'fds')
+HOST_METRICS = ('load', 'cpus')
+
+
+class ProcFile(object):
+    def __init__(self, path, size=_BUF_SIZE):
+        self._src = io.FileIO(path, 'r')
+        self._buf = bytearray(size)
+
+    def read(self):
+        self._src.seek(0)
+        size = self._src.readinto(self._buf)
+        return self._buf[:size]
+
+    def close(self):
+        self._src.close()
+
+
+def read_comm(pid):
+    with open('/proc/%i/comm' % pid, 'rt') as src:
+        return src.read().strip()
+
+
+def _keyed(data, keys):
+    """Values of the `keys' of a '<key>: <value>' file, as ints."""
+    found = {}
+    for line in data.splitlines():
+        key, _, value = bytes(line).partition(b':')
+        found[key] = value
+    return tuple(int(found[key]) for key in keys)
+
+
+def _rates(now, then, elapsed):
+    return [round((a - b) / elapsed, 1) if elapsed > 0 else 0.
+            for a, b in zip(now, then)]
+
+
+class Process(object):
+    """
+    Fields of /proc/<pid>/stat, counted after the command name:
+    0 state, 1 ppid, ..., 7 minflt, 9 majflt, 11 utime, 12 stime, ...,
+    17 num_threads.
+    Besides cpu, memory and threads, the METRICS in `metrics' are
+    sampled: 'faults' come with the stat file, the others cost one
+    more read() or listdir() per tick.
+    """
+    def __init__(self, pid, now, metrics=()):
+        self.pid = pid
+        self.comm = read_comm(pid)
+        self._stat = ProcFile('/proc/%i/stat' % pid)
+        self._statm = ProcFile('/proc/%i/statm' % pid)
+        self._metrics = set(metrics)
+        self._status = None
+        self._io = None
+        self._fd = '/proc/%i/fd' % pid
+        if 'ctx' in self._metrics:
+            self._status = ProcFile('/proc/%i/status' % pid)
+        try:
+            # both need to be root or the owner of the process
+            if 'io' in self._metrics:
+                self._io = ProcFile('/proc/%i/io' % pid, 1024)
+                self._io.read()
+            if 'fds' in self._metrics:
+                os.listdir(self._fd)
+        except (IOError, OSError) as exc:
+            if exc.errno != errno.EACCES:
+                raise
+            logging.warning('pid %i: no access to io and fds', pid)
+            self._metrics.difference_update(('io', 'fds'))
+            if self._io is not None:
+                self._io.close()
+                self._io = None
+        fields = self._fields()
+        self.ppid = int(fields[1])
+        self._counters = self._count(fields)
+        self._when = now
+
+    def _fields(self):
+        data = self._stat.read()
+        return data[data.rindex(b')') + 2:].split()
+
+    def _count(self, fields):
+        counters = {'cpu': (int(fields[11]) + int(fields[12]),)}
+        if 'faults' in self._metrics:
+            counters['faults'] = (int(fields[7]), int(fields[9]))
+        if self._status is not None:
+            counters['ctx'] = _keyed(self._status.read(),
+                                     (b'voluntary_ctxt_switches',
+                                      b'nonvoluntary_ctxt_switches'))
+        if self._io is not None:
+            counters['io'] = _keyed(self._io.read(),
+                                    (b'read_bytes', b'write_bytes'))
+        return counters
+
+    def sample(self, now):
+        """
+        Returns {'cpu': percent, 'memory': [rss, vms], 'threads': count}
+        plus the selected metrics:
+          'ctx': [voluntary, involuntary] context switches per second
+          'faults': [minor, major] page faults per second
+          'io': [read, written] storage bytes per second
+          'fds': open file descriptors
+        The CPU usage and the rates are averaged since the previous
+        sample; 100% CPU is one core.
+        """
+        fields = self._fields()
+        counters = self._count(fields)
+        elapsed = now - self._when
+        cpu = ((counters['cpu'][0] - self._counters['cpu'][0]) /
+               _CLK_TCK / elapsed * 100. if elapsed > 0 else 0.)
+        statm = self._statm.read().split()
+        sample = {
+            'cpu': round(cpu, 1),
+            'memory': [int(statm[1]) * _PAGE_SIZE,
+                       int(statm[0]) * _PAGE_SIZE],
+            'threads': int(fields[17])}
+        for name in ('ctx', 'faults', 'io'):
+            if name in counters:
+                sample[name] = _rates(counters[name], self._counters[name],
+                                      elapsed)
+        if 'fds' in self._metrics:
+            sample['fds'] = len(os.listdir(self._fd))
+        self._counters, self._when = counters, now
+        return sample
+
+    def close(self):
+        for src in (self._stat, self._statm, self._status, self._io):
+            if src is not None:
+                src.close()
+
+
+class Threads(object):
+    """
+    Per-thread CPU usage of a process, from /proc/<pid>/task/*/stat.
+    The stat files of the known threads stay open; new threads are
+    picked up, and exited ones dropped, at every sample.
+    """
+    def __init__(self, pid, now):
+        self._base = '/proc/%i/task' % pid
+        self._tasks = {}  # tid -> [stat file, cpu ticks]
+        self._when = now
+        self._scan(now)
+
+    def _scan(self, now):
+        elapsed = now - self._when
+        self._when = now
+        tids = set(int(tid) for tid in os.listdir(self._base))
+        for tid in list(self._tasks):
+            if tid not in tids:
+                self._tasks.pop(tid)[0].close()
+        usage = []
+        for tid in tids:
+            task = self._tasks.get(tid)
+            try:
+                if task is None:
+                    # threads born after the previous sample have
+                    # spent all their CPU time since then
+                    task = [ProcFile('%s/%i/stat' % (self._base, tid), 1024),
+                            0]
+                    self._tasks[tid] = task
+                data = task[0].read()
+            except (IOError, OSError):
+                continue  # just exited
+            end = data.rindex(b')')
+            comm = data[data.index(b'(') + 1:end].decode('utf-8', 'replace')
+            fields = data[end + 2:].split()
+            ticks = int(fields[11]) + int(fields[12])
+            if elapsed > 0:
+                usage.append(((ticks - task[1]) / _CLK_TCK / elapsed * 100.,
+                              tid, comm))
+            task[1] = ticks
+        return usage
+
+    def sample(self, now, top):
+        """
+        Returns [tid, name, cpu percent] for the `top' threads which
+        used most CPU since the previous sample.
+        """
+        usage = sorted(self._scan(now), reverse=True)[:top]
+        return [[tid, comm, round(cpu, 1)] for cpu, tid, comm in usage]
+
+    def close(self):
+        for task in self._tasks.values():
+            task[0].close()
+        self._tasks.clear()
+
+
+class Host(object):
+    """
+    CPU usage from the cpu lines of /proc/stat; 100% overall means all
+    the cores are busy, 100% of a single cpu ('cpus') is one core.
+    With 'load' in `metrics', also the load averages.
+    """
+    def __init__(self, metrics=()):
+        self._percpu = 'cpus' in metrics
+        self._stat = ProcFile('/proc/stat', 16 * _BUF_SIZE)
+        self._loadavg = None
+        if 'load' in metrics:
+            self._loadavg = ProcFile('/proc/loadavg', 256)
+        self._times = self._read()
+
+    def _read(self):
+        times = []
+        for line in self._stat.read().splitlines():
+            if not line.startswith(b'cpu'):
+                break
+            # user nice system idle iowait irq softirq steal; guest time
+            # is already accounted in user and nice
+            values = [int(v) for v in line.split()[1:9]]
+            total = sum(values)
+            times.append((total - sum(values[3:5]), total))
+            if not self._percpu:
+                break
+        return times
+
+    def sample(self):
+        """
+        Returns {'cpu': percent} plus, if selected, 'cpus': [percent]
+        and 'load': [1, 5, 15 minutes load average].
+        """
+        times = self._read()
+        usage = []
+        for (busy, total), (busy0, total0) in zip(times, self._times):
+            delta = total - total0
+            cpu = (busy - busy0) * 100. / delta if delta > 0 else 0.
+            usage.append(round(cpu, 1))
+        self._times = times
+        sample = {'cpu': usage[0]}
+        if self._percpu:
+            sample['cpus'] = usage[1:]
+        if self._loadavg is not None:
+            sample['load'] = [float(v)
+                              for v in self._loadavg.read().split()[:3]]
+        return sample
+
+    def close(self):
+        self._stat.close()
+        if self._loadavg is not None:
+            self._loadavg.close()
@@ -0,0 +1,194 @@
+"""
+Flight recorder for long runs.
+
+The samples of the last minutes are kept in memory only, in a ring of
+preallocated slots holding the records as sampled: they are serialized
+only when dumped, not on every tick. When a trigger fires, the
+recording goes on for the post-trigger window, then the ring, holding
+both the pre- and post-trigger windows, is dumped to its own file.
+A trigger firing while a dump is pending gets its own dump, after its
+own post-trigger window.
+Triggers fire when their condition starts to hold, so a condition
+lasting for hours gives one dump, not one per window.
+
+Trigger specs, comma separated:
+  cpu=PERCENT:SECS   CPU usage above PERCENT for SECS seconds
+  rss=MIB:SECS       RSS grown by more than MIB MiB within SECS seconds
+  threads=COUNT      thread count changed by COUNT or more in one tick
+"""
+
+import collections
+import errno
+import json
+import logging
+import math
+import os
+import time
+
+
+class CpuTrigger(object):
+    def __init__(self, name, percent, secs):
+        self.kind = 'cpu'
+        self._name = name
+        self._percent = percent
+        self._secs = secs
+        self._since = None
+
+    def check(self, record):
+        sample = record.get(self._name)
+        if sample is None or sample['cpu'] <= self._percent:
+            self._since = None
+            return False
+        if self._since is None:
+            self._since = record['timestamp']
+        return record['timestamp'] - self._since >= self._secs
+
+
+class RssTrigger(object):
+    def __init__(self, name, mib, secs):
+        self.kind = 'rss'
+        self._name = name
+        self._growth = mib * 1024 * 1024
+        self._secs = secs
+        self._window = collections.deque()  # (timestamp, rss)
+
+    def check(self, record):
+        sample = record.get(self._name)
+        if sample is None:
+            self._window.clear()  # restarted, maybe
+            return False
+        now = record['timestamp']
+        rss = sample['memory'][0]
+        self._window.append((now, rss))
+        while now - self._window[0][0] > self._secs:
+            self._window.popleft()
+        return rss - min(value for _, value in self._window) > self._growth
+
+
+class ThreadsTrigger(object):
+    def __init__(self, name, jump):
+        self.kind = 'threads'
+        self._name = name
+        self._jump = jump
+        self._threads = None
+
+    def check(self, record):
+        sample = record.get(self._name)
+        threads = None if sample is None else sample['threads']
+        jumped = (threads is not None and self._threads is not None and
+                  abs(threads - self._threads) >= self._jump)
+        self._threads = threads
+        return jumped
+
+
+def parse_triggers(spec, name='vdsm_main'):
+    """
+    Returns the triggers described by `spec', watching the process
+    `name'. Raises ValueError if `spec' is malformed.
+    """
+    triggers = []
+    for item in spec.split(','):
+        if not item:
+            continue
+        kind, _, args = item.partition('=')
+        values = [float(arg) for arg in args.split(':')]
+        if kind == 'cpu' and len(values) == 2:
+            triggers.append(CpuTrigger(name, *values))
+        elif kind == 'rss' and len(values) == 2:
+            triggers.append(RssTrigger(name, *values))
+        elif kind == 'threads' and len(values) == 1:
+            triggers.append(ThreadsTrigger(name, *values))
+        else:
+            raise ValueError('bad trigger: %s' % item)
+    return triggers
+
+
+class Recorder(object):
+    """
+    Writer keeping the samples of the last `before' + `after' seconds,
+    taken every `interval' seconds, and dumping them `after' seconds
+    past a trigger, to '<prefix>.<date>-<time>.<n>.<trigger>.json',
+    <n> counting the dumps. Triggers firing while a dump is pending get
+    their own dump. Existing files are never overwritten.
+    """
+    def __init__(self, prefix, interval, before, after, triggers):
+        self._prefix = prefix
+        self._triggers = triggers
+        self._active = [False] * len(triggers)
+        # the records as sampled: serialized only when dumped
+        self._slots = [None] * int(math.ceil((before + after) / interval))
+        self._next = 0
+        self._after = int(math.ceil(after / interval))
+        self._pending = []  # [stamp, trigger, samples still to take]
+        self._dumps = 0
+        self._requested = None
+
+    def request(self, reason):
+        """Fires a trigger by hand, e.g. from a signal handler."""
+        self._requested = reason
+
+    def _check(self, record):
+        fired = None
+        for idx, trigger in enumerate(self._triggers):
+            active = trigger.check(record)
+            if active and not self._active[idx] and fired is None:
+                fired = trigger.kind
+            self._active[idx] = active
+        if self._requested is not None:
+            fired, self._requested = self._requested, None
+        return fired
+
+    def write_record(self, record):
+        fired = self._check(record)
+        if fired is not None:
+            if self._pending:
+                logging.warning('triggered: %s, while %i dumps are pending',
+                                fired, len(self._pending))
+            else:
+                logging.warning('triggered: %s', fired)
+            record['trigger'] = fired
+            self._pending.append([
+                time.strftime('%Y%m%d-%H%M%S',
+                              time.localtime(record['timestamp'])),
+                fired, self._after])
+        self._slots[self._next] = record
+        self._next = (self._next + 1) % len(self._slots)
+        for pending in self._pending:
+            pending[2] -= 1
+        while self._pending and self._pending[0][2] <= 0:
+            self._dump(*self._pending.pop(0)[:2])
+
+    def _create(self, stamp, kind):
+        """Returns (path, file) of a new dump file."""
+        while True:
+            self._dumps += 1
+            path = '%s.%s.%i.%s.json' % (self._prefix, stamp, self._dumps,
+                                         kind)
+            try:
+                fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                             0o644)
+            except OSError as exc:
+                if exc.errno != errno.EEXIST:
+                    raise
+                continue  # left by an earlier run with the same prefix
+            return path, os.fdopen(fd, 'wt')
+
+    def _dump(self, stamp, kind):
+        records = self._slots[self._next:] + self._slots[:self._next]
+        path, out = self._create(stamp, kind)
+        with out:
+            for record in records:
+                if record is not None:
+                    out.write('%s\n' % json.dumps(record))
+            out.flush()
+            os.fsync(out.fileno())
+        logging.info('dumped %s', path)
+
+    def flush(self):
+        pass  # nothing is written until a trigger fires
+
+    def close(self):
+        """Dumps what was recorded so far past the pending triggers."""
+        for stamp, kind, _ in self._pending:
+            self._dump(stamp, kind)
+        self._pending = []
@@ -1,65 +1,75 @@
 #!/usr/bin/env python
 
 import argparse
-import csv
-import json
 import os
 import os.path
 import sys
 
 import matplotlib.pyplot as plt
+import numpy
+
+# modules shared by all the tools, see common/
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                os.pardir, os.pardir, 'common'))
+import dataset
 
 
 _COLORS = ('r', 'b', 'g', 'k', 'm', 'y')
+_NAN = float('nan')
 
 
 def getdata(source):
-    if source.endswith('csv'):
-        return get_data_csv(source)
-    elif source.endswith('json'):
-        return get_data_json(source)
-    else:
-        raise RuntimeError('unsupported data source: %s' % source)
-
-
-def get_data_csv(source):
-    with open(source, 'rt') as src:
-        feed = csv.reader(src)
-        libvirt, vdsm, cpus = [], [], []
-        for row in feed:
-            libvirt.append(float(row[1]))
-            vdsm.append(float(row[4]))
-            cpus.append(float(row[-1]))
-        return libvirt, vdsm, cpus, [], []
-
-
-def get_data_json(source):
-    with open(source, 'rt') as src:
-        libvirt, vdsm, cpus, sampler, mom = [], [], [], [], []
-        for line in src:
-            feed = json.loads(line)
-            libvirt.append(feed["libvirtd"]["cpu"])
-            vdsm.append(feed["vdsm_main"]["cpu"])
-            cpus.append(feed["host"]["cpu"])
-            if "vdsm_sampler" in feed:
-                sampler.append(feed["vdsm_sampler"]["cpu"])
-            elif "vmon" in feed:
-                sampler.append(feed["vmon"]["cpu"])
-            if "momd" in feed:
-                mom.append(feed["momd"]["cpu"])
-            elif "python" in feed:  # ugly bug, ugly fix
-                mom.append(feed["python"]["cpu"])
-        return libvirt, vdsm, cpus, sampler, mom
-
-
-def subdraw(plot, ylabel, xlabel, sort_values, worst_values, *args):
-    L = list(sorted(len(seq) for seq in args))
+    """
+    Any file dataset.load reads; samplefmt files may come from either
+    sampler, so the layout is told by the columns, not the extension.
+    """
+    data = dataset.load(source)
+    if 'host.cpu' in data:
+        return get_data_capture(data)
+    return get_data_vdsmmon(data)
+
+
+def _column(data, *names):
+    """
+    Processes may come and go while sampling (see discovery.py):
+    a missing one shows as a gap in the plot.
+    """
+    for name in names:
+        if name in data:
+            return data[name]
+    return numpy.full(len(data['timestamp']), _NAN)
+
+
+def _seen(seq):
+    return seq if numpy.any(seq == seq) else []
+
+
+def get_data_vdsmmon(data):
+    hosts = sorted((column for column in data
+                    if column.startswith('host.cpu[')),
+                   key=lambda column: int(column[len('host.cpu['):-1]))
+    return (data['libvirtd.cpu'], data['vdsm.cpu'], data[hosts[-1]],
+            [], [], data['timestamp'])
+
+
+def get_data_capture(data):
+    return (_column(data, 'libvirtd.cpu'),
+            _column(data, 'vdsm_main.cpu'),
+            data['host.cpu'],
+            _seen(_column(data, 'vdsm_sampler.cpu', 'vmon.cpu')),
+            _seen(_column(data, 'momd.cpu',
+                          'python.cpu')),  # ugly bug, ugly fix
+            data['timestamp'])
+
+
+def subdraw(plot, ylabel, xlabel, sort_values, worst_values, stamps, *args):
     seqs = []
-    for seq in args:
-        if seq:
+    for seq, ts in zip(args, stamps):
+        if len(seq):
             seqs.append(seq)
         else:
-            seqs.append([0] * L[-1])
+            # as long as the samples of the same file
+            seqs.append(numpy.zeros(len(ts)))
 
     N  = min(len(seq) for seq in seqs)
     W = 0.2
@@ -71,11 +81,14 @@ def subdraw(plot, ylabel, xlabel, sort_values, worst_values, *args):
         t = range(N)
 
     plt.subplot(plot)
-    for color, seq in zip(_COLORS, seqs):
+    for color, seq, ts in zip(_COLORS, seqs, stamps):
+        if not sort_values:
+            # real elapsed time, not the sample index
+            t = ts[:N] - ts[0]
         if worst_values:
-            dataset = list(sorted(seq[:N]))[N-nv:]
+            dataset = numpy.sort(seq[:N])[N-nv:]
         elif sort_values:
-            dataset = list(sorted(seq[:N]))
+            dataset = numpy.sort(seq[:N])
         else:
             dataset = seq[:N]
         plt.plot(t, dataset, color)
@@ -85,7 +98,21 @@ def subdraw(plot, ylabel, xlabel, sort_values, worst_values, *args):
     plt.grid(True)
 
 
-def draw(sort_values, worst_values, out_file, *data):
+def baseline(source):
+    """
+    Mean host CPU usage of a calibration run (capture.py -C or
+    vdsmmon.py -C): the idle host plus the sampler itself.
+    """
+    cpus = getdata(source)[2]
+    cpus = cpus[cpus == cpus]
+    return float(cpus.mean()) if len(cpus) else 0.
+
+
+def _subtract(seq, base):
+    return numpy.maximum(seq - base, 0.)
+
+
+def draw(sort_values, worst_values, out_file, base, *data):
     if worst_values:
         sort_values = True
 
@@ -94,18 +121,20 @@ def draw(sort_values, worst_values, out_file, *data):
         for color, datafile in zip(_COLORS, data))
 
     data = [getdata(datafile) for datafile in data]
-    libvirt, vdsm, cpus, sampler, mom = zip(*data)
+    libvirt, vdsm, cpus, sampler, mom, stamps = zip(*data)
+    if base:
+        cpus = [_subtract(seq, base) for seq in cpus]
 
     plt.figure(1)
     plt.suptitle(title)
 
-    ax = plt.subplot(321 if any(sampler) else 411)
+    ax = plt.subplot(321 if any(len(seq) for seq in sampler) else 411)
     xticks = ['libvirt', 'vdsm', 'host']
     ext = False
-    if any(sampler):
+    if any(len(seq) for seq in sampler):
         xticks.append('sampler')
         ext = True
-    if any(mom):
+    if any(len(seq) for seq in mom):
         xticks.append('mom')
         ext = True
 
@@ -128,6 +157,7 @@ def draw(sort_values, worst_values, out_file, *data):
             xlabel,
             sort_values,
             worst_values,
+            stamps,
             *libvirt)
 
     subdraw(324 if ext else 413,
@@ -135,6 +165,7 @@ def draw(sort_values, worst_values, out_file, *data):
             xlabel,
             sort_values,
             worst_values,
+            stamps,
             *vdsm)
 
     subdraw(322 if ext else 414,
@@ -142,22 +173,25 @@ def draw(sort_values, worst_values, out_file, *data):
             xlabel,
             sort_values,
             worst_values,
+            stamps,
             *cpus)
 
-    if any(sampler):
+    if any(len(seq) for seq in sampler):
         subdraw(325,
                 'sampler cpu %',
                 xlabel,
                 sort_values,
                 worst_values,
+                stamps,
                 *sampler)
 
-    if any(mom):
+    if any(len(seq) for seq in mom):
         subdraw(326,
                 'mom cpu %',
                 xlabel,
                 sort_values,
                 worst_values,
+                stamps,
                 *mom)
 
     if out_file:
@@ -172,7 +206,7 @@ def draw(sort_values, worst_values, out_file, *data):
 def _main():
     parser = argparse.ArgumentParser(description="simplistic VDSM bench plot")
     parser.add_argument('datafiles', metavar='data.csv', type=str, nargs='+',
-                        help='VDSM benchmark dataset (CSV)')
+                        help='VDSM benchmark dataset (CSV, JSON or bin)')
     parser.add_argument('--sort', dest='sort_values', action='store_true',
                         default=False,
                         help='sort the samples')
@@ -181,10 +215,19 @@ def _main():
                         help='show only worst 20% of samples')
     parser.add_argument('--out', dest='out_file', type=str,
                         help='save to file')
+    parser.add_argument('--baseline', dest='baseline', type=str,
+                        help='subtract the host cpu usage of this '
+                             'calibration run')
 
     args = parser.parse_args()
 
-    draw(args.sort_values, args.worst_values, args.out_file, *args.datafiles)
+    base = 0.
+    if args.baseline:
+        base = baseline(args.baseline)
+        print 'baseline host cpu: %.1f%%' % base
+
+    draw(args.sort_values, args.worst_values, args.out_file, base,
+         *args.datafiles)
 
 
 if __name__ == "__main__":